@@ -1,24 +1,146 @@
+import asyncio
+import hashlib
 import logging
+import os
+import weakref
+from collections import OrderedDict
 
+import db
+import telemetry
+from botocore.exceptions import BotoCoreError, ClientError
+from cache import SONGS
 from google import genai
 
 logger = logging.getLogger()
 
-client = genai.Client()
+MODEL = "gemini-3.5-flash-lite"
+PROMPT = "Explain this hymn in up to 7 lines"
+EXPLAIN_CACHE_SIZE = int(os.getenv("EXPLAIN_CACHE_SIZE", "256"))
+AI_TIMEOUT_SECONDS = float(os.getenv("AI_TIMEOUT_SECONDS", "20"))
+AI_CONCURRENCY = int(os.getenv("AI_CONCURRENCY", "4"))  # model calls in flight
+# Show the explanation as it is generated, by editing the message per chunk
+AI_STREAM = os.getenv("AI_STREAM") == "1"
+AI_STREAM_EDIT_INTERVAL = 1.0  # seconds; Telegram throttles frequent edits
 
 disclaimer = "\n\n<i>Generated by AI (Google Gemini 3.5)</i>"
 error_message = "<i>This feature is temporarily unavailable</i>"
 
+_explanations = OrderedDict()
+_in_flight = {}
 
-def explainSong(lyrics):
-    response = ""
+
+def explanation_key(song_number):
+    # The model and prompt are part of the digest along with the lyrics, so
+    # changing any of them regenerates rather than serving an old answer
+    content = "\n".join((MODEL, PROMPT, SONGS[song_number])).encode("UTF-8")
+    return f"{song_number} {hashlib.sha1(content).hexdigest()[:12]}"
+
+
+class _LoopState:
+    # The async client's connection pool and the semaphore both belong to the
+    # event loop that first uses them, and lambda_handler starts a new loop per
+    # update, so each loop gets its own
+    def __init__(self):
+        self.client = genai.Client().aio
+        self.semaphore = asyncio.Semaphore(AI_CONCURRENCY)
+
+
+_loop_states = weakref.WeakKeyDictionary()
+
+
+def _loop_state():
+    loop = asyncio.get_running_loop()
+    state = _loop_states.get(loop)
+    if state is None:
+        state = _loop_states[loop] = _LoopState()
+    return state
+
+
+@telemetry.timed("ai.generate")
+async def generate(lyrics, on_text=None):
+    """Asks the model for an explanation. With on_text, the response is
+    streamed and on_text is awaited with the text so far after every chunk.
+    Raises on failure, so that errors are never cached."""
+    state = _loop_state()
+    async with state.semaphore:
+        if on_text is None:
+            response = await state.client.models.generate_content(
+                model=MODEL, contents=[PROMPT, lyrics]
+            )
+            text = response.text
+        else:
+            text = ""
+            stream = await state.client.models.generate_content_stream(
+                model=MODEL, contents=[PROMPT, lyrics]
+            )
+            async for chunk in stream:
+                if chunk.text:
+                    text += chunk.text
+                    await on_text(text)
+    # A blocked or empty response has no text
+    if not text:
+        raise ValueError("The model returned no text")
+    return text
+
+
+def remember(key, text):
+    _explanations[key] = text
+    _explanations.move_to_end(key)
+    while len(_explanations) > EXPLAIN_CACHE_SIZE:
+        _explanations.popitem(last=False)
+
+
+async def lookup(song_number, on_text=None):
+    key = explanation_key(song_number)
+    text = _explanations.get(key)
+    if text is not None:
+        _explanations.move_to_end(key)
+        return text
+    # tsms_explanations is only a cache, so its failures only skip it
+    try:
+        item = (await db.explanations.get_item(Key={"id": key})).get("Item")
+    except (BotoCoreError, ClientError):
+        logger.exception("Reading the explanation of %s failed", song_number)
+        item = None
+    if item and item.get("text"):
+        text = item["text"]
+    else:
+        text = await asyncio.wait_for(
+            generate(SONGS[song_number], on_text), AI_TIMEOUT_SECONDS
+        )
+        try:
+            await db.explanations.put_item(Item={"id": key, "text": text})
+        except (BotoCoreError, ClientError):
+            logger.exception("Saving the explanation of %s failed", song_number)
+    remember(key, text)
+    return text
+
+
+@telemetry.timed("ai.explainSong")
+async def explainSong(song_number, on_text=None):
+    """Returns the explanation message for a song, from the in-memory cache,
+    then tsms_explanations, and only then the model. Taps on the same song
+    that arrive while it is being looked up share that one lookup; only the
+    tap that started it receives on_text calls. Returns error_message if the
+    model fails or takes longer than AI_TIMEOUT_SECONDS."""
+    key = explanation_key(song_number)
+    task = _in_flight.get(key)
+    # lambda_handler runs each update in a fresh event loop, so a task left
+    # over from an earlier invocation can't be awaited
+    if task is None or task.get_loop() is not asyncio.get_running_loop():
+        task = asyncio.ensure_future(lookup(song_number, on_text))
+        _in_flight[key] = task
+
+        def forget(done):
+            if _in_flight.get(key) is done:
+                del _in_flight[key]
+
+        task.add_done_callback(forget)
     try:
-        response = client.models.generate_content(
-            model="gemini-3.5-flash-lite",
-            contents=["Explain this hymn in up to 7 lines", lyrics],
-        ).text
-        response += disclaimer
+        return await asyncio.shield(task) + disclaimer
+    except asyncio.TimeoutError:
+        logger.warning("explainSong timed out after %ss for %s", AI_TIMEOUT_SECONDS, song_number)
+        return error_message
     except Exception:
         logger.exception("explainSong failed")
-        response = error_message
-    return response
+        return error_message
@@ -0,0 +1,125 @@
+import asyncio
+import logging
+import os
+import time
+from datetime import timedelta
+
+from telegram.error import BadRequest, NetworkError, RetryAfter, TelegramError, TimedOut
+
+logger = logging.getLogger()
+
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", "30"))  # msgs/sec, all chats
+BROADCAST_PER_CHAT_RATE = float(os.getenv("BROADCAST_PER_CHAT_RATE", "1"))
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", "10"))
+BROADCAST_MAX_RETRIES = int(os.getenv("BROADCAST_MAX_RETRIES", "3"))
+# A flood wait longer than this is treated as a failure rather than stalling
+# the whole invocation
+BROADCAST_MAX_RETRY_AFTER = float(os.getenv("BROADCAST_MAX_RETRY_AFTER", "10"))
+PER_CHAT_BUCKETS = 10000
+
+# What Broadcaster.send reports for a message
+DELIVERED = "DELIVERED"
+UNKNOWN = "DELIVERY_UNKNOWN"  # timed out; it may or may not have arrived
+FAILED = "DELIVERY_FAILED"
+
+
+class TokenBucket:
+    """Rate limiter using the virtual-scheduling form of a token bucket: each
+    reservation pushes the theoretical arrival time forward by one interval.
+    It only reads the clock, so unlike asyncio.Lock it is safe to share across
+    the per-invocation event loops lambda_handler creates."""
+
+    def __init__(self, rate, capacity=1):
+        self.interval = 1 / rate
+        self.tolerance = (capacity - 1) * self.interval
+        self.tat = 0.0
+
+    def reserve(self):
+        """Claims the next slot and returns how long to wait for it."""
+        now = time.monotonic()
+        tat = max(self.tat, now)
+        self.tat = tat + self.interval
+        return max(0.0, tat - self.tolerance - now)
+
+    def pause(self, seconds):
+        self.tat = max(self.tat, time.monotonic() + seconds + self.tolerance)
+
+    def idle(self):
+        return self.tat <= time.monotonic()
+
+
+class Broadcaster:
+    def __init__(
+        self,
+        rate=BROADCAST_RATE,
+        per_chat_rate=BROADCAST_PER_CHAT_RATE,
+        concurrency=BROADCAST_CONCURRENCY,
+        max_retries=BROADCAST_MAX_RETRIES,
+        max_retry_after=BROADCAST_MAX_RETRY_AFTER,
+    ):
+        self.bucket = TokenBucket(rate)
+        self.per_chat_rate = per_chat_rate
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.max_retry_after = max_retry_after
+        self.chat_buckets = {}
+
+    def _chat_bucket(self, chat_id):
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self.chat_buckets) >= PER_CHAT_BUCKETS:
+                self.chat_buckets = {k: b for k, b in self.chat_buckets.items() if not b.idle()}
+            bucket = TokenBucket(self.per_chat_rate)
+            self.chat_buckets[chat_id] = bucket
+        return bucket
+
+    async def send(self, chat_id, send_fn):
+        """Awaits send_fn(chat_id) within the global and per-chat limits,
+        retrying flood waits and connection errors. Returns DELIVERED,
+        UNKNOWN if the send timed out, or FAILED if it gave up."""
+        chat_bucket = self._chat_bucket(chat_id)
+        for attempt in range(self.max_retries + 1):
+            await asyncio.sleep(max(self.bucket.reserve(), chat_bucket.reserve()))
+            try:
+                await send_fn(chat_id)
+                return DELIVERED
+            except RetryAfter as e:
+                delay = e.retry_after
+                if isinstance(delay, timedelta):
+                    delay = delay.total_seconds()
+                if delay > self.max_retry_after:
+                    logger.warning("Giving up on %s: flood wait of %ss", chat_id, delay)
+                    return FAILED
+                # Telegram's flood limit is per bot, so hold back every send
+                self.bucket.pause(delay)
+                chat_bucket.pause(delay)
+            except TimedOut:
+                # The message may have been delivered before the response was
+                # lost, so a retry could send it twice
+                logger.warning("Timed out sending to %s; not retrying", chat_id)
+                return UNKNOWN
+            except NetworkError as e:
+                # BadRequest subclasses NetworkError but won't succeed on retry
+                if isinstance(e, BadRequest):
+                    logger.exception("Failed to send to %s", chat_id)
+                    return FAILED
+                await asyncio.sleep(min(2**attempt * 0.5, self.max_retry_after))
+            except TelegramError:
+                logger.exception("Failed to send to %s", chat_id)
+                return FAILED
+        logger.warning("Giving up on %s after %d attempts", chat_id, self.max_retries + 1)
+        return FAILED
+
+    async def broadcast(self, chat_ids, send_fn):
+        """Sends to every chat with at most `concurrency` in flight. Returns
+        {chat_id: outcome}."""
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def send_one(chat_id):
+            async with semaphore:
+                return chat_id, await self.send(chat_id, send_fn)
+
+        return dict(await asyncio.gather(*(send_one(chat_id) for chat_id in chat_ids)))
+
+
+broadcaster = Broadcaster()
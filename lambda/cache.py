@@ -0,0 +1,19 @@
+import os
+
+import snapshot
+
+_directory = os.path.dirname(__file__)
+_tables = snapshot.load(os.path.join(_directory, "cache.bin"))
+
+# Per-book shards, only mapped the first time a song from that book is looked up
+BOOKS = snapshot.Shards(os.path.join(_directory, "books"))
+
+TITLES = _tables["TITLES"]
+SONGS = BOOKS.table("SONGS")
+CHORDS = BOOKS.table("CHORDS")
+SCORES = _tables["SCORES"]
+MP3 = _tables["MP3"]
+PIANO = _tables["PIANO"]
+VIDEOS = _tables["VIDEOS"]
+CA_LINKS = _tables["CA_LINKS"]
+SGM_LINKS = _tables["SGM_LINKS"]
@@ -0,0 +1,33 @@
+from telegram import InlineKeyboardMarkup
+
+# Telegram's limits for one message: 4096 characters of text and, in practice,
+# 100 buttons in an inline keyboard
+MAX_TEXT = 4096
+MAX_BUTTONS = 100
+
+
+class Reply:
+    """The text and inline keyboard of one message, which further sections
+    join for as long as the message stays within Telegram's limits, so that
+    they cost no round trips of their own."""
+
+    def __init__(self, text, keyboard=()):
+        self.text = text
+        self.keyboard = list(keyboard)
+
+    def buttons(self):
+        return sum(len(row) for row in self.keyboard)
+
+    def add(self, footer, rows):
+        """Appends footer to the text and rows to the keyboard, or returns
+        False and leaves the reply as it was if they don't fit."""
+        # The length with HTML tags overestimates the length Telegram counts
+        text = self.text.rstrip("\n") + "\n\n" + footer
+        if len(text) > MAX_TEXT or self.buttons() + sum(len(row) for row in rows) > MAX_BUTTONS:
+            return False
+        self.text = text
+        self.keyboard.extend(rows)
+        return True
+
+    def markup(self):
+        return InlineKeyboardMarkup(self.keyboard)
@@ -0,0 +1,201 @@
+import asyncio
+import functools
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+import telemetry
+
+DB_WORKERS = int(os.getenv("DB_WORKERS", "16"))
+BATCH_GET_LIMIT = 100  # keys per batch_get_item request
+BATCH_GET_ATTEMPTS = 5
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "1024"))
+# Bounds how long a change made by another container (e.g. being joined to a
+# Community by someone else's search) can go unseen here
+USER_CACHE_TTL_SECONDS = int(os.getenv("USER_CACHE_TTL_SECONDS", "30"))
+
+# boto3 calls block, so they run on a bounded pool of worker threads and the
+# event loop can overlap them. Building a session costs 100-200 ms of CPU, so
+# the workers share one resource, built on first use: its actions only call
+# its client, which is thread safe, and the bot never loads a resource's
+# attributes, the part that isn't.
+_executor = ThreadPoolExecutor(max_workers=DB_WORKERS, thread_name_prefix="dynamodb")
+_lock = threading.Lock()
+_shared = None
+_tables = {}
+
+
+def _resource():
+    global _shared
+    with _lock:
+        if _shared is None:
+            _shared = boto3.session.Session().resource("dynamodb")
+        return _shared
+
+
+def table(name):
+    """The boto3 Table on the shared resource."""
+    resource = _resource()
+    with _lock:
+        cached = _tables.get(name)
+        if cached is None or cached[0] is not resource:
+            cached = _tables[name] = (resource, resource.Table(name))
+    return cached[1]
+
+
+async def run(fn, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, functools.partial(fn, *args, **kwargs))
+
+
+class AsyncTable:
+    """Awaitable wrapper over a DynamoDB table with the same call signatures
+    as boto3's Table resource."""
+
+    def __init__(self, name):
+        self.name = name
+
+    def _table(self):
+        return table(self.name)
+
+    async def get_item(self, **kwargs):
+        return await run(lambda: self._table().get_item(**kwargs))
+
+    async def put_item(self, **kwargs):
+        return await run(lambda: self._table().put_item(**kwargs))
+
+    async def update_item(self, **kwargs):
+        return await run(lambda: self._table().update_item(**kwargs))
+
+
+users = AsyncTable("tsms_users")
+groups = AsyncTable("tsms_groups")
+recents = AsyncTable("tsms_recents")
+files = AsyncTable("tsms_files")
+explanations = AsyncTable("tsms_explanations")
+
+
+class TTLCache:
+    """Size-bounded LRU whose entries also expire ttl seconds after being set."""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None or entry[0] <= time.monotonic():
+            self._entries.pop(key, None)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def peek(self, key):
+        entry = self._entries.get(key)
+        if entry is None or entry[0] <= time.monotonic():
+            return None
+        return entry[1]
+
+    def replace(self, key, value):
+        # Keeps the original expiry, so a value derived from a cached one is
+        # never fresher than what it was derived from
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries[key] = (entry[0], value)
+
+    def set(self, key, value):
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+
+user_cache = TTLCache(USER_CACHE_SIZE, USER_CACHE_TTL_SECONDS)
+
+
+def report_user_cache():
+    """Counts the user cache's hits and misses since the last report into
+    telemetry, as user_cache.Hits and user_cache.Misses."""
+    if user_cache.hits or user_cache.misses:
+        telemetry.count("user_cache.Hits", user_cache.hits)
+        telemetry.count("user_cache.Misses", user_cache.misses)
+    user_cache.hits = user_cache.misses = 0
+
+
+async def get_user(user_id):
+    """Returns the tsms_users get_item response for user_id, reusing the one
+    from an earlier update in this container while it is fresh. Only users
+    that exist are cached, so one who registers elsewhere is seen at once."""
+    response = user_cache.get(user_id)
+    if response is None:
+        response = await users.get_item(Key={"id": user_id})
+        if "Item" not in response:
+            return {}
+        response = {"Item": response["Item"]}
+        user_cache.set(user_id, response)
+    return response
+
+
+def cache_user(user_id, item):
+    user_cache.set(user_id, {"Item": item})
+
+
+def update_cached_user(user_id, remove=(), **attributes):
+    # Mirrors a write the bot just made, so the next read doesn't go stale.
+    # Builds a new item rather than mutating one a caller may still hold.
+    response = user_cache.peek(user_id)
+    if response is None or "Item" not in response:
+        return
+    item = {k: v for k, v in response["Item"].items() if k not in remove}
+    item.update(attributes)
+    user_cache.replace(user_id, {"Item": item})
+
+
+async def get_user_names(user_ids):
+    """Returns {user_id: name} for every id, from the user cache where fresh
+    and otherwise with batch_get_item projected to the name attribute.
+    Projected items are partial, so they are not added to the cache."""
+    names = {}
+    missing = []
+    for user_id in user_ids:
+        response = user_cache.peek(user_id)
+        if response is None:
+            missing.append(user_id)
+        else:
+            names[user_id] = response.get("Item", {}).get("name")
+    chunks = [missing[i : i + BATCH_GET_LIMIT] for i in range(0, len(missing), BATCH_GET_LIMIT)]
+    for fetched in await asyncio.gather(*(run(_batch_get_names, chunk) for chunk in chunks)):
+        names.update(fetched)
+    return names
+
+
+def _batch_get_names(user_ids):
+    names = dict.fromkeys(user_ids)
+    request = {
+        users.name: {
+            "Keys": [{"id": user_id} for user_id in user_ids],
+            "ProjectionExpression": "id, #n",
+            "ExpressionAttributeNames": {"#n": "name"},
+        }
+    }
+    for attempt in range(BATCH_GET_ATTEMPTS):
+        if attempt:
+            time.sleep(min(0.05 * 2**attempt, 1))
+        response = _resource().batch_get_item(RequestItems=request)
+        for item in response["Responses"].get(users.name, []):
+            names[int(item["id"])] = item.get("name")
+        # DynamoDB returns whatever it couldn't serve under throttling or the
+        # 16 MB response cap; back off and ask again for just those keys, and
+        # leave the names of any still unserved at None
+        request = response.get("UnprocessedKeys")
+        if not request:
+            break
+    return names
@@ -3,38 +3,40 @@ import time
 from decimal import Decimal
 from types import SimpleNamespace
 
-import boto3
+import broadcast
+import db
+import telemetry
 import templates
 from botocore.exceptions import ClientError
 from cache import TITLES
 from telegram import constants
-from telegram.error import TelegramError
-
-dynamodb = boto3.resource("dynamodb")
 
 GROUP_FORMATION_THRESHOLD = 3
 RECENTS_TTL_SECONDS = 60
 GROUP_TTL_SECONDS = 3600
 
 
-def get_active_group(user_id, dbUser):
+@telemetry.timed("groups.get_active_group")
+async def get_active_group(user_id, dbUser):
     group_id = dbUser["Item"].get("group")
     if not group_id:
         return None
-    group = dynamodb.Table("tsms_groups").get_item(Key={"id": group_id}).get("Item")
+    group = (await db.groups.get_item(Key={"id": group_id})).get("Item")
     if not group or int(group.get("ttl", 0)) <= int(time.time()):
-        dynamodb.Table("tsms_users").update_item(
+        await db.users.update_item(
             Key={"id": user_id},
             UpdateExpression="REMOVE #g",
             ExpressionAttributeNames={"#g": "group"},
         )
+        db.update_cached_user(user_id, remove=("group",))
         return None
     return group_id
 
 
-async def community_join(context, saveLog, user_id, song_number, group_id):
+@telemetry.timed("groups.community_join")
+async def community_join(context, saveLog, user_id, song_number, group_id, log_user=None):
     try:
-        dynamodb.Table("tsms_groups").update_item(
+        await db.groups.update_item(
             Key={"id": group_id},
             UpdateExpression="ADD #u :u",
             ConditionExpression="attribute_exists(id)",
@@ -45,31 +47,48 @@ async def community_join(context, saveLog, user_id, song_number, group_id):
         if e.response["Error"]["Code"] == "ConditionalCheckFailedException":
             return  # group already expired/gone, don't resurrect it
         raise
-    dynamodb.Table("tsms_users").update_item(
+    await db.users.update_item(
         Key={"id": user_id},
         UpdateExpression="SET #g = :g",
         ExpressionAttributeNames={"#g": "group"},
         ExpressionAttributeValues={":g": group_id},
     )
+    db.update_cached_user(user_id, group=group_id)
     title = TITLES[song_number].title()
-    try:
-        await context.bot.send_message(
-            chat_id=user_id,
+    # if the DM fails they can't be notified, but they're still joined
+    dm_outcome = await broadcast.broadcaster.send(
+        user_id,
+        lambda chat_id: context.bot.send_message(
+            chat_id=chat_id,
             text=templates.community_join.format(title=title),
             parse_mode=constants.ParseMode.HTML,
-        )
-        dm_sent = True
-    except TelegramError:
-        dm_sent = False  # can't notify this member, but they're still joined
-    saveLog(get_log_user(user_id), "GROUP", group_id, "JOIN" if dm_sent else "JOIN_NO_DM")
+        ),
+    )
+    if log_user is None:
+        log_user = await get_log_user(user_id)
+    statuses = {broadcast.DELIVERED: "JOIN", broadcast.UNKNOWN: "JOIN_DM_UNKNOWN"}
+    status = statuses.get(dm_outcome, "JOIN_NO_DM")
+    saveLog(log_user, "GROUP", group_id, status)
 
 
-def get_log_user(user_id):
-    dbUser = dynamodb.Table("tsms_users").get_item(Key={"id": user_id}).get("Item", {})
+async def get_log_user(user_id):
+    dbUser = (await db.get_user(user_id)).get("Item", {})
     return SimpleNamespace(id=user_id, full_name=dbUser.get("name"), username=None)
 
 
-def try_mark_sent(group_id, song_number):
+@telemetry.timed("groups.get_log_users")
+async def get_log_users(user_ids):
+    """Bulk get_log_user: resolves every member's name in one batch before a
+    fan-out instead of one get_item per member."""
+    names = await db.get_user_names(list(user_ids))
+    return {
+        user_id: SimpleNamespace(id=user_id, full_name=name, username=None)
+        for user_id, name in names.items()
+    }
+
+
+@telemetry.timed("groups.try_mark_sent")
+async def try_mark_sent(group_id, song_number):
     """Marks song as sent; returns the member id set, or None if the group is
     gone/expired or the song was already sent."""
     now = int(time.time())
@@ -80,7 +99,7 @@ def try_mark_sent(group_id, song_number):
         # existence check into the same condition (rather than a separate
         # pre-read) also avoids a redundant get_item, since get_active_group
         # has already confirmed liveness immediately before this is called.
-        response = dynamodb.Table("tsms_groups").update_item(
+        response = await db.groups.update_item(
             Key={"id": group_id},
             UpdateExpression="ADD #s :s SET #ttl = :ttl",
             ConditionExpression="attribute_exists(id) AND (attribute_not_exists(#s) OR NOT contains(#s, :song))",
@@ -99,9 +118,10 @@ def try_mark_sent(group_id, song_number):
     return {int(u) for u in response["Attributes"].get("users", set())}
 
 
-def leave_group(user_id, group_id):
+@telemetry.timed("groups.leave_group")
+async def leave_group(user_id, group_id):
     try:
-        dynamodb.Table("tsms_groups").update_item(
+        await db.groups.update_item(
             Key={"id": group_id},
             UpdateExpression="DELETE #u :u",
             ConditionExpression="attribute_exists(id)",
@@ -111,17 +131,18 @@ def leave_group(user_id, group_id):
     except ClientError as e:
         if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
             raise  # group already expired/gone, nothing to remove them from
-    dynamodb.Table("tsms_users").update_item(
+    await db.users.update_item(
         Key={"id": user_id},
         UpdateExpression="REMOVE #g",
         ExpressionAttributeNames={"#g": "group"},
     )
+    db.update_cached_user(user_id, remove=("group",))
 
 
+@telemetry.timed("groups.process_search_event")
 async def process_search_event(context, saveLog, user, song_number, active_group_id):
     now = int(time.time())
-    recents_table = dynamodb.Table("tsms_recents")
-    item = recents_table.get_item(Key={"song": song_number}).get("Item")
+    item = (await db.recents.get_item(Key={"song": song_number})).get("Item")
     if item and int(item.get("ttl", 0)) <= now:
         item = None
 
@@ -134,7 +155,7 @@ async def process_search_event(context, saveLog, user, song_number, active_group
         }
         if active_group_id:
             new_item["group"] = active_group_id
-        recents_table.put_item(Item=new_item)
+        await db.recents.put_item(Item=new_item)
         return
 
     recents_group_id = item.get("group")
@@ -145,7 +166,7 @@ async def process_search_event(context, saveLog, user, song_number, active_group
                 # CAS guard: get_item above is eventually consistent, so without
                 # this a stale read could clobber a group tag another concurrent
                 # request already wrote moments ago.
-                recents_table.update_item(
+                await db.recents.update_item(
                     Key={"song": song_number},
                     UpdateExpression="SET #g = :g",
                     ConditionExpression="attribute_not_exists(#g)",
@@ -170,7 +191,7 @@ async def process_search_event(context, saveLog, user, song_number, active_group
             # Atomically claim group-formation for this song: only one concurrent
             # request can win this write. ConditionExpression + a shared table
             # provide the compare-and-swap that a plain read-then-write can't.
-            recents_table.update_item(
+            await db.recents.update_item(
                 Key={"song": song_number},
                 UpdateExpression="SET #g = :g",
                 ConditionExpression="attribute_not_exists(#g)",
@@ -182,27 +203,31 @@ async def process_search_event(context, saveLog, user, song_number, active_group
                 raise
             # Lost the race - another request already formed a group for this
             # song. Join that one instead of creating a duplicate.
-            winner = recents_table.get_item(
-                Key={"song": song_number}, ConsistentRead=True
+            winner = (
+                await db.recents.get_item(Key={"song": song_number}, ConsistentRead=True)
             ).get("Item", {})
             winning_group_id = winner.get("group")
             if winning_group_id:
                 await community_join(context, saveLog, user.id, song_number, winning_group_id)
             return
 
-        dynamodb.Table("tsms_groups").put_item(
+        await db.groups.put_item(
             Item={
                 "id": group_id,
                 "ttl": Decimal(now + GROUP_TTL_SECONDS),
                 "users": updated_users,
             }
         )
+        log_users = await get_log_users(updated_users)
         await asyncio.gather(
-            *(community_join(context, saveLog, uid, song_number, group_id) for uid in updated_users)
+            *(
+                community_join(context, saveLog, uid, song_number, group_id, log_users[uid])
+                for uid in updated_users
+            )
         )
         return
 
-    recents_table.update_item(
+    await db.recents.update_item(
         Key={"song": song_number},
         UpdateExpression="ADD #u :u",
         ExpressionAttributeNames={"#u": "users"},
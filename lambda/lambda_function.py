@@ -1,23 +1,25 @@
 import asyncio
+import functools
 import logging
 import os
-import re
+import time
 import traceback
 from datetime import datetime, timedelta, timezone
 from decimal import Decimal
-from io import BytesIO
 
 import ai
-import boto3
+import broadcast
+import compose
+import db
 import groups
+import logs
+import normalize
+import ppt
+import songsearch
+import telemetry
 import templates
+import workers
 from cache import CA_LINKS, CHORDS, MP3, PIANO, SCORES, SGM_LINKS, SONGS, TITLES, VIDEOS
-from lookup import SONGS_LOOKUP, TITLES_LOOKUP
-from pptx import Presentation
-from pptx.dml.color import RGBColor
-from pptx.enum.text import MSO_ANCHOR, MSO_AUTO_SIZE, PP_ALIGN
-from pptx.util import Inches, Pt
-from rapidfuzz import fuzz, process
 from telegram import (
     InlineKeyboardButton,
     InlineKeyboardMarkup,
@@ -29,7 +31,7 @@ from telegram import (
     Update,
     constants,
 )
-from telegram.error import TelegramError
+from telegram.error import BadRequest, TelegramError
 from telegram.ext import (
     Application,
     CallbackQueryHandler,
@@ -38,22 +40,27 @@ from telegram.ext import (
     MessageHandler,
     filters,
 )
-from unidecode import unidecode
 
 logger = logging.getLogger()
 logger.setLevel("INFO")
 
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 VIDEOS_S3_BUCKET = os.getenv("VIDEOS_S3_BUCKET")
+# Answer without waiting for the log write. The write finishes when the
+# container next runs, so logs are lost if Lambda recycles it first.
+LOG_FIRE_AND_FORGET = os.getenv("LOG_FIRE_AND_FORGET") == "1"
+# Keep one event loop and one initialized Application for the life of the
+# container instead of rebuilding both for every update
+PERSISTENT_RUNTIME = os.getenv("PERSISTENT_RUNTIME") == "1"
 
 app = Application.builder().token(BOT_TOKEN).build()
-dynamodb = boto3.resource("dynamodb")
+log_sink = logs.DynamoDBSink("tsms_logs")
 
 
 def saveLog(user, event, request, response):
     now = datetime.now(timezone.utc)
-    dynamodb.Table("tsms_logs").put_item(
-        Item={
+    log_sink.put(
+        {
             "user_id": user.id,
             "name": user.full_name,
             "username": user.username,
@@ -66,8 +73,9 @@ def saveLog(user, event, request, response):
     )
 
 
-def getDbUser(user):
-    dbUser = dynamodb.Table("tsms_users").get_item(Key={"id": user.id})
+@telemetry.timed("getDbUser")
+async def getDbUser(user):
+    dbUser = await db.get_user(user.id)
     return dbUser
 
 
@@ -80,14 +88,16 @@ async def require_registration(update: Update, dbUser, action) -> bool:
 
 
 async def reply_and_log(update: Update, text, event, request=None, response=None, **kwargs):
-    await update.message.reply_html(text, **kwargs)
+    with telemetry.timer("telegram.send"):
+        await update.message.reply_html(text, **kwargs)
     saveLog(update.effective_user, event, request, response)
 
 
 async def send_and_log(update: Update, text, event, request=None, response=None, **kwargs):
-    await update.effective_chat.send_message(
-        text=text, parse_mode=constants.ParseMode.HTML, **kwargs
-    )
+    with telemetry.timer("telegram.send"):
+        await update.effective_chat.send_message(
+            text=text, parse_mode=constants.ParseMode.HTML, **kwargs
+        )
     saveLog(update.effective_user, event, request, response)
 
 
@@ -96,7 +106,7 @@ async def updateState(update: Update, dbUser) -> None:
     phone = dbUser["Item"]["phone"].lstrip("+")
     state = dbUser["Item"]["state"]
     if state != templates.current_version:
-        dynamodb.Table("tsms_users").update_item(
+        await db.users.update_item(
             Key={"id": user.id},
             UpdateExpression="SET phone = :phone, #st = :state",
             ExpressionAttributeValues={
@@ -105,6 +115,7 @@ async def updateState(update: Update, dbUser) -> None:
             },
             ExpressionAttributeNames={"#st": "state"},
         )
+        db.update_cached_user(user.id, phone=phone, state=templates.current_version)
         await reply_and_log(update, templates.changelog, "CHANGELOG", response=templates.current_version)
 
 
@@ -123,14 +134,14 @@ async def contact(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     contact = update.message.contact
     phone = contact.phone_number.lstrip("+")
     if user.id == contact.user_id and phone.startswith(templates.allowed_phone):
-        dynamodb.Table("tsms_users").put_item(
-            Item={
-                "id": user.id,
-                "name": user.full_name,
-                "phone": phone,
-                "state": templates.current_version,
-            }
-        )
+        item = {
+            "id": user.id,
+            "name": user.full_name,
+            "phone": phone,
+            "state": templates.current_version,
+        }
+        await db.users.put_item(Item=item)
+        db.cache_user(user.id, item)
         await reply_and_log(
             update, templates.welcome, "CONTACT", request=phone, response="Allowed",
             reply_markup=ReplyKeyboardRemove(),
@@ -145,7 +156,7 @@ async def contact(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
 
 
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    dbUser = getDbUser(update.effective_user)
+    dbUser = await getDbUser(update.effective_user)
     if not await require_registration(update, dbUser, "HELP"):
         return
     await reply_and_log(
@@ -166,21 +177,35 @@ def make_button(song_number, option, callback_prefix, button_text):
     return []
 
 
+def link_rows(links):
+    return [[InlineKeyboardButton(key, url=value)] for key, value in links.items()]
+
+
+def song_rows(song_numbers, prefix=""):
+    rows = []
+    for number in song_numbers:
+        rows.extend(make_button(number, True, "SONG", f"{prefix}{number} {TITLES[number]}"))
+    return rows
+
+
 async def send_link_buttons(update: Update, links, source, song_number) -> None:
-    keyboard = [
-        [InlineKeyboardButton(key, url=value)] for key, value in links.items()
-    ]
     await send_and_log(
         update, f"Links provided by {source}", "LINKS", request=source, response=song_number,
         disable_web_page_preview=True,
-        reply_markup=InlineKeyboardMarkup(keyboard),
+        reply_markup=InlineKeyboardMarkup(link_rows(links)),
     )
 
 
+@telemetry.timed("send_song")
 async def send_song(
-    update: Update, context: ContextTypes.DEFAULT_TYPE, song_number, dbUser, event, request
+    update: Update, context: ContextTypes.DEFAULT_TYPE, song_number, dbUser, event, request,
+    also_found=(), followups=(),
 ) -> None:
-    active_group_id = groups.get_active_group(update.effective_user.id, dbUser)
+    """Sends the lyrics with the song's link buttons and the also_found
+    results in the same message where they fit, then everything that has to
+    be a message of its own, including the followups (functions returning
+    awaitables), at once."""
+    active_group_id = await groups.get_active_group(update.effective_user.id, dbUser)
     keyboard = []
     keyboard.extend(
         make_button(song_number, song_number in CHORDS, "CHORDS", "🎸 Guitar Chords")
@@ -216,82 +241,98 @@ async def send_song(
             song_number, active_group_id is not None, "GROUP_SEND", "📢 Send to Community"
         )
     )
+    reply = compose.Reply(lyrics, keyboard)
+    separate = []
+    for links, source in (
+        (CA_LINKS.get(song_number), "cityalight.com"),
+        (SGM_LINKS.get(song_number), "sovereigngracemusic.com"),
+    ):
+        if not links:
+            continue
+        if reply.add(f"<i>Links provided by {source}</i>", link_rows(links)):
+            saveLog(update.effective_user, "LINKS", source, song_number)
+        else:
+            separate.append(functools.partial(send_link_buttons, update, links, source, song_number))
+    if also_found:
+        response = f"{len(also_found)} results"
+        if reply.add("<i>📖 This song is also found in other books</i>", song_rows(also_found, "📖 ")):
+            saveLog(update.effective_user, "SEARCH_ALSO_FOUND", request, response)
+        else:
+            separate.append(
+                functools.partial(
+                    reply_and_log,
+                    update, "<i>This song is also found in:</i>", "SEARCH_ALSO_FOUND",
+                    request=request, response=response,
+                    reply_markup=InlineKeyboardMarkup(song_rows(also_found)),
+                )
+            )
     await send_and_log(
-        update, lyrics, event, request=request, response=f"{song_number} {TITLES[song_number]}",
+        update, reply.text, event, request=request, response=f"{song_number} {TITLES[song_number]}",
         disable_web_page_preview=True,
-        reply_markup=InlineKeyboardMarkup(keyboard),
+        reply_markup=reply.markup(),
+    )
+    # Only the order relative to the lyrics matters
+    await asyncio.gather(
+        *(send() for send in [*separate, *followups]),
+        groups.process_search_event(context, saveLog, update.effective_user, song_number, active_group_id),
     )
-    if song_number in CA_LINKS:
-        await send_link_buttons(update, CA_LINKS[song_number], "cityalight.com", song_number)
-    if song_number in SGM_LINKS:
-        await send_link_buttons(update, SGM_LINKS[song_number], "sovereigngracemusic.com", song_number)
-    await groups.process_search_event(context, saveLog, update.effective_user, song_number, active_group_id)
 
 
 async def search(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     user = update.effective_user
-    dbUser = getDbUser(user)
+    dbUser = await getDbUser(user)
     if not await require_registration(update, dbUser, "SEARCH"):
         return
     raw_message = update.message.text
-    message = unidecode(raw_message).replace("\n", " ").strip().upper()
+    message = normalize.fold(raw_message)
     hint = message.startswith("TSMS")
     if message.isnumeric():  # handle default book
         message = int(message)
         message = "TSMS " + str(message)
-    song_number = None
-    results = []
-    if message in SONGS:  # match song number
-        song_number = message
-    else:  # match title
-        alpha_only = re.compile("[^A-Z ]")
-        clean_message = alpha_only.sub("", message).strip()
-        if clean_message in TITLES_LOOKUP:
-            results = TITLES_LOOKUP.get(clean_message).copy()
-            song_number = results.pop(0)
-        else:  # search
-            if len(clean_message) > 200:
-                await reply_and_log(
-                    update, "<i>Please shorten your search</i>", "SEARCH_TOO_LONG", request=raw_message
-                )
-                return
-            await update.message.reply_chat_action(constants.ChatAction.TYPING)
-            query = process.extract(
-                clean_message,
-                SONGS_LOOKUP,
-                scorer=fuzz.partial_ratio,
-                score_cutoff=85,
-                limit=10,
+    result = songsearch.exact(message)
+    if result is None:
+        clean_message = normalize.search_text(message)
+        if len(clean_message) > 200:
+            await reply_and_log(
+                update, "<i>Please shorten your search</i>", "SEARCH_TOO_LONG", request=raw_message
             )
-            results = [t[2] for t in query]
+            return
+        await update.message.reply_chat_action(constants.ChatAction.TYPING)
+        try:
+            result = await songsearch.search(clean_message, workers.threads.run)
+        except workers.Busy:
+            await reply_and_log(
+                update, f"<i>{templates.busy}</i>", "SEARCH_BUSY", request=raw_message
+            )
+            return
+    logger.info("SEARCH %s %s", result.stage, result.timings)
+    for stage, elapsed in result.timings.items():
+        telemetry.record("search." + stage, elapsed)
+    song_number, results = result.song_number, result.results
 
     if song_number:
-        await send_song(update, context, song_number, dbUser, "SEARCH_HIT", raw_message)
+        followups = [functools.partial(updateState, update, dbUser)]
         if hint:
-            await reply_and_log(
-                update,
-                "<i>Hint: Get to TSMS songs faster by typing the song number without 'TSMS'</i>",
-                "SEARCH_HINT", request=raw_message, response=song_number,
+            followups.append(
+                functools.partial(
+                    reply_and_log,
+                    update,
+                    "<i>Hint: Get to TSMS songs faster by typing the song number without 'TSMS'</i>",
+                    "SEARCH_HINT", request=raw_message, response=song_number,
+                )
             )
+        await send_song(
+            update, context, song_number, dbUser, "SEARCH_HIT", raw_message,
+            also_found=results, followups=followups,
+        )
+        return
     if results:
-        keyboard = []
-        for number in results:
-            keyboard.extend(
-                make_button(number, True, "SONG", f"{number} {TITLES[number]}")
-            )
-        if song_number:
-            await reply_and_log(
-                update, "<i>This song is also found in:</i>", "SEARCH_ALSO_FOUND",
-                request=raw_message, response=f"{len(results)} results",
-                reply_markup=InlineKeyboardMarkup(keyboard),
-            )
-        else:
-            await reply_and_log(
-                update, "<i>Showing up to 10 search results:</i>", "SEARCH_RESULTS",
-                request=raw_message, response=f"{len(results)} results",
-                reply_markup=InlineKeyboardMarkup(keyboard),
-            )
-    elif not song_number:
+        await reply_and_log(
+            update, "<i>Showing up to 10 search results:</i>", "SEARCH_RESULTS",
+            request=raw_message, response=f"{len(results)} results",
+            reply_markup=InlineKeyboardMarkup(song_rows(results)),
+        )
+    else:
         await reply_and_log(
             update, "<i>No matches found</i>\n\nType /help for instructions", "SEARCH_NONE",
             request=raw_message,
@@ -299,87 +340,56 @@ async def search(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     await updateState(update, dbUser)
 
 
-def make_ppt(song_number):
-    prs = Presentation()
-    prs.slide_width = Inches(16)
-    prs.slide_height = Inches(9)
-
-    title = TITLES.get(song_number)
-    text = SONGS.get(song_number)
-    text = text.split("\n\n")
-    text.pop(0)
-    text = list(filter(None, text))
-
-    originallen = len(text)
-    chorus = None
-    for i in range(originallen):
-        stanza = text[i]
-        if stanza.startswith("Chorus:") or stanza.startswith("Refrain:"):
-            chorus = i
-            break
-    if chorus is not None:
-        i = chorus + 2
-        while True:
-            text.insert(i, stanza)
-            i += 2
-            if i > len(text):
-                break
-
-    blank_slide_layout = prs.slide_layouts[6]
-    slide = prs.slides.add_slide(blank_slide_layout)
-    background = slide.background
-    fill = background.fill
-    fill.solid()
-    fill.fore_color.rgb = RGBColor(0, 0, 0)
-
-    txBox = slide.shapes.add_textbox(0, 0, Inches(16), Inches(9))
-    tf = txBox.text_frame
-    tf.vertical_anchor = MSO_ANCHOR.MIDDLE
-    p = tf.add_paragraph()
-    p.text = title + "\n(" + song_number + ")"
-    p.font.size = Pt(60)
-    p.font.bold = True
-    p.font.color.rgb = RGBColor(255, 255, 255)
-    p.alignment = PP_ALIGN.CENTER
-
-    for i in range(len(text)):
-        blank_slide_layout = prs.slide_layouts[6]
-        slide = prs.slides.add_slide(blank_slide_layout)
-        background = slide.background
-        fill = background.fill
-        fill.solid()
-        fill.fore_color.rgb = RGBColor(0, 0, 0)
-
-        txBox = slide.shapes.add_textbox(Inches(15), 0, Inches(1), Inches(1))
-        tf = txBox.text_frame
-        p = tf.add_paragraph()
-        p.text = "{}/{}".format(i + 1, len(text))
-        p.font.size = Pt(32)
-        p.font.color.rgb = RGBColor(255, 255, 255)
-
-        txBox = slide.shapes.add_textbox(0, 0, Inches(16), Inches(9))
-        tf = txBox.text_frame
-        tf.vertical_anchor = MSO_ANCHOR.MIDDLE
-        tf.word_wrap = True
-        tf.auto_size = MSO_AUTO_SIZE.SHAPE_TO_FIT_TEXT
-        p = tf.add_paragraph()
-        p.text = text[i].strip()
-        p.font.size = Pt(48)
-        if song_number.startswith("C "):
-            p.font.size = Pt(32)
-        p.font.bold = True
-        p.font.color.rgb = RGBColor(255, 255, 255)
-        p.alignment = PP_ALIGN.CENTER
-    pptxfile = BytesIO()
-    pptxfile.name = song_number + ".pptx"
-    prs.save(pptxfile)
-    pptxfile.seek(0)
-    return pptxfile
+@telemetry.timed("send_ppt")
+async def send_ppt(update: Update, song_number) -> None:
+    file_id = await ppt.get_file_id(song_number)
+    if file_id:
+        try:
+            await update.effective_chat.send_document(document=file_id)
+            return
+        except BadRequest:
+            logger.warning("Stored PPT file_id for %s was rejected, re-uploading", song_number)
+    # Raises workers.Busy before anything is sent
+    with telemetry.timer("ppt.render"):
+        data = await workers.processes.run(ppt.deck_bytes, song_number)
+    message = await update.effective_chat.send_document(document=ppt.deck_file(song_number, data))
+    await ppt.save_file_id(song_number, message.document.file_id)
+
+
+async def send_explanation(update: Update, song_number) -> None:
+    if not ai.AI_STREAM:
+        response = await ai.explainSong(song_number)
+        await update.effective_chat.send_message(response, parse_mode=constants.ParseMode.HTML)
+        return
+
+    message = None
+    last_edit = 0.0
+
+    async def show_partial(text):
+        # Partial text goes out unformatted, since a chunk can end in the
+        # middle of a tag
+        nonlocal message, last_edit
+        if message is not None and time.monotonic() - last_edit < ai.AI_STREAM_EDIT_INTERVAL:
+            return
+        try:
+            if message is None:
+                message = await update.effective_chat.send_message(text)
+            else:
+                await message.edit_text(text)
+        except TelegramError:
+            logger.warning("Failed to show partial explanation for %s", song_number)
+        last_edit = time.monotonic()
+
+    response = await ai.explainSong(song_number, on_text=show_partial)
+    if message is None:
+        await update.effective_chat.send_message(response, parse_mode=constants.ParseMode.HTML)
+    else:
+        await message.edit_text(response, parse_mode=constants.ParseMode.HTML)
 
 
 async def answer_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     user = update.effective_user
-    dbUser = getDbUser(user)
+    dbUser = await getDbUser(user)
     if not await require_registration(update, dbUser, "CALLBACK"):
         return
     query = update.callback_query
@@ -431,26 +441,27 @@ async def answer_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         song_number = data.replace("PPT ", "")
         await update.effective_chat.send_action(constants.ChatAction.UPLOAD_DOCUMENT)
         saveLog(user, "CALLBACK", "PPT", song_number)
-        ppt = make_ppt(song_number)
-        await update.effective_chat.send_document(document=ppt)
+        try:
+            await send_ppt(update, song_number)
+        except workers.Busy:
+            await query.answer(text=templates.busy, show_alert=True)
+            saveLog(user, "CALLBACK_BUSY", "PPT", song_number)
+            return
     elif data.startswith("EXPLAIN "):
         song_number = data.replace("EXPLAIN ", "")
         await update.effective_chat.send_action(constants.ChatAction.TYPING)
         saveLog(user, "CALLBACK", "EXPLAIN", song_number)
         await query.answer(text="Thinking...")
-        response = ai.explainSong(SONGS.get(song_number))
-        await update.effective_chat.send_message(
-            response, parse_mode=constants.ParseMode.HTML
-        )
+        await send_explanation(update, song_number)
     elif data.startswith("GROUP_SEND "):
         song_number = data.replace("GROUP_SEND ", "")
         saveLog(user, "CALLBACK", "GROUP_SEND", song_number)
-        active_group_id = groups.get_active_group(user.id, dbUser)
+        active_group_id = await groups.get_active_group(user.id, dbUser)
         if active_group_id is None:
             await query.answer(text="You are currently not in a Community", show_alert=True)
             saveLog(user, "GROUP_SEND_BLOCKED", song_number, "NOT_IN_COMMUNITY")
             return
-        members = groups.try_mark_sent(active_group_id, song_number)
+        members = await groups.try_mark_sent(active_group_id, song_number)
         if members is None:
             await query.answer(text="Song has already been sent.", show_alert=True)
             saveLog(user, "GROUP_SEND_BLOCKED", song_number, "ALREADY_SENT")
@@ -459,22 +470,21 @@ async def answer_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             name=user.full_name
         )
 
-        async def send_to_member(member_id):
-            log_user = groups.get_log_user(member_id)
-            try:
-                await context.bot.send_message(
-                    chat_id=member_id,
-                    text=lyrics,
-                    parse_mode=constants.ParseMode.HTML,
-                    disable_web_page_preview=True,
-                )
-            except TelegramError:
-                logger.exception("Failed to deliver GROUP_SEND to %s", member_id)
-                saveLog(log_user, "GROUP", active_group_id, f"DELIVERY_FAILED {song_number}")
-                return
-            saveLog(log_user, "GROUP", active_group_id, f"RECEIVED {song_number}")
+        log_users = await groups.get_log_users(members)
+
+        def send_to_member(member_id):
+            return context.bot.send_message(
+                chat_id=member_id,
+                text=lyrics,
+                parse_mode=constants.ParseMode.HTML,
+                disable_web_page_preview=True,
+            )
 
-        await asyncio.gather(*(send_to_member(member_id) for member_id in members))
+        outcomes = await broadcast.broadcaster.broadcast(members, send_to_member)
+        for member_id, outcome in outcomes.items():
+            if outcome == broadcast.DELIVERED:
+                outcome = "RECEIVED"
+            saveLog(log_users[member_id], "GROUP", active_group_id, f"{outcome} {song_number}")
         saveLog(user, "GROUP", active_group_id, f"SEND {song_number}")
     else:
         await query.answer(text="This feature is not available")
@@ -485,37 +495,71 @@ async def answer_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 
 async def leave(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     user = update.effective_user
-    dbUser = getDbUser(user)
+    dbUser = await getDbUser(user)
     if not await require_registration(update, dbUser, "LEAVE"):
         return
-    active_group_id = groups.get_active_group(user.id, dbUser)
+    active_group_id = await groups.get_active_group(user.id, dbUser)
     if active_group_id is None:
         await reply_and_log(update, templates.group_not_in_community, "LEAVE_BLOCKED")
         return
-    groups.leave_group(user.id, active_group_id)
+    await groups.leave_group(user.id, active_group_id)
     await reply_and_log(update, templates.group_left, "GROUP", request=active_group_id, response="LEAVE")
 
 
+async def process_event(bot_app, event):
+    logger.info("PROCESSING UPDATE: %s", event)
+    await logs.wait_for_background()
+    try:
+        with telemetry.timer("update"):
+            await bot_app.process_update(Update.de_json(event, bot_app.bot))
+    finally:
+        with telemetry.timer("logs.flush"):
+            await logs.flush(log_sink, wait=not LOG_FIRE_AND_FORGET)
+        db.report_user_cache()
+        telemetry.flush()
+
+
 async def tg_bot_main(bot_app, event):
     async with bot_app:
-        logger.info("PROCESSING UPDATE: %s", event)
-        await bot_app.process_update(Update.de_json(event, bot_app.bot))
+        await process_event(bot_app, event)
+
+
+persistent_loop = None
+
+
+def run_persistent(bot_app, event):
+    # The loop only runs while an invocation is in progress; between them the
+    # container is frozen along with the bot's idle pooled connections, which
+    # httpx reopens if Telegram has closed them in the meantime
+    global persistent_loop
+    if persistent_loop is None:
+        persistent_loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(persistent_loop)
+    persistent_loop.run_until_complete(bot_app.initialize())
+    persistent_loop.run_until_complete(process_event(bot_app, event))
 
 
 def lambda_handler(event, context):
     if "healthCheck" in event:
         return {"statusCode": 200}
     try:
-        asyncio.run(tg_bot_main(app, event))
+        if PERSISTENT_RUNTIME:
+            run_persistent(app, event)
+        else:
+            asyncio.run(tg_bot_main(app, event))
     except Exception as e:
         traceback.print_exc()
         return {"statusCode": 500}
     return {"statusCode": 200}
 
 
-app.add_handler(CommandHandler("start", start))
-app.add_handler(MessageHandler(filters.CONTACT, contact))
-app.add_handler(CommandHandler("help", help_command))
-app.add_handler(CommandHandler("leave", leave))
-app.add_handler(MessageHandler(filters.TEXT, search))
-app.add_handler(CallbackQueryHandler(answer_callback))
+def add_handlers(bot_app):
+    bot_app.add_handler(CommandHandler("start", start))
+    bot_app.add_handler(MessageHandler(filters.CONTACT, contact))
+    bot_app.add_handler(CommandHandler("help", help_command))
+    bot_app.add_handler(CommandHandler("leave", leave))
+    bot_app.add_handler(MessageHandler(filters.TEXT, search))
+    bot_app.add_handler(CallbackQueryHandler(answer_callback))
+
+
+add_handlers(app)
@@ -0,0 +1,77 @@
+import asyncio
+import logging
+
+import db
+
+logger = logging.getLogger()
+
+# Futures of the writes fire-and-forget flushes started, which may still be running
+_background = []
+
+
+class DynamoDBSink:
+    """Buffers log items in memory and writes them with batch_write_item when
+    flushed. boto3's batch_writer sends 25 items per request and re-queues any
+    UnprocessedItems until they are accepted."""
+
+    def __init__(self, table_name):
+        self.table_name = table_name
+        self.pending = []
+
+    def put(self, item):
+        self.pending.append(item)
+
+    def take(self):
+        items, self.pending = self.pending, []
+        return items
+
+    def write(self, items):
+        try:
+            with db.table(self.table_name).batch_writer() as batch:
+                for item in items:
+                    batch.put_item(Item=item)
+        except Exception:
+            logger.exception("Failed to write %d log items", len(items))
+
+
+class MemorySink:
+    """Keeps every flushed item in a list; for tests and local runs."""
+
+    def __init__(self):
+        self.pending = []
+        self.items = []
+
+    def put(self, item):
+        self.pending.append(item)
+
+    def take(self):
+        items, self.pending = self.pending, []
+        return items
+
+    def write(self, items):
+        self.items.extend(items)
+
+
+async def flush(sink, wait=True):
+    # The batch is taken on the event loop, where every put happens, so no
+    # item can slip in between reading and resetting the buffer. The write is
+    # blocking I/O, so it runs on db's worker pool, whose threads (unlike
+    # asyncio's default executor, rebuilt by every asyncio.run) outlive the
+    # update. Without wait the write is submitted to the pool and the update
+    # completes without waiting for DynamoDB. On Lambda the write is frozen
+    # with the container: it resumes on the next thaw, and wait_for_background
+    # at the start of the next update lets it finish, but if the container is
+    # recycled instead those items are lost.
+    items = sink.take()
+    if not items:
+        return
+    if wait:
+        await db.run(sink.write, items)
+    else:
+        _background.append(db._executor.submit(sink.write, items))
+
+
+async def wait_for_background():
+    """Waits for the writes earlier fire-and-forget flushes left running."""
+    while _background:
+        await asyncio.wrap_future(_background.pop())
@@ -0,0 +1,11 @@
+import os
+
+import snapshot
+from cache import BOOKS
+
+_tables = snapshot.load(os.path.join(os.path.dirname(__file__), "lookup.bin"))
+
+TITLES_LOOKUP = _tables["TITLES_LOOKUP"]
+SONGS_LOOKUP = BOOKS.table("SONGS_LOOKUP")
+# Digest of the normalized titles and lyrics, for caches of derived results
+VERSION = _tables["META"]["VERSION"]
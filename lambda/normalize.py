@@ -0,0 +1,34 @@
+import string
+
+from unidecode import unidecode
+
+# Shared by utilities/cacheloader.py, which builds the lookup keys, and the
+# search handler, which normalizes queries, so the two can't disagree.
+# unidecode maps ASCII to itself, so ASCII input (nearly every query) skips it
+# and goes straight to a single str.translate pass.
+
+# Uppercase, with newlines as spaces
+FOLD_TABLE = str.maketrans(string.ascii_lowercase + "\n", string.ascii_uppercase + " ")
+# As FOLD_TABLE, then drop every other ASCII character but letters and spaces
+SEARCH_TABLE = {
+    code: FOLD_TABLE.get(code, code)
+    if chr(code) in string.ascii_letters + " \n"
+    else None
+    for code in range(128)
+}
+
+
+def ascii_text(text):
+    return text if text.isascii() else unidecode(text)
+
+
+def fold(text):
+    """Transliterated to ASCII, uppercased, on one line and stripped; song
+    numbers are matched against this."""
+    return ascii_text(text).translate(FOLD_TABLE).strip()
+
+
+def search_text(text):
+    """fold() reduced to letters and spaces: the form titles and lyrics are
+    indexed in and queries are scored in."""
+    return ascii_text(text).translate(SEARCH_TABLE).strip()
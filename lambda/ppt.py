@@ -0,0 +1,287 @@
+import hashlib
+import logging
+import os
+import re
+import zipfile
+from functools import lru_cache
+from io import BytesIO
+from xml.sax.saxutils import escape
+
+import db
+from botocore.exceptions import BotoCoreError, ClientError
+from cache import SONGS, TITLES
+from pptx import Presentation
+from pptx.dml.color import RGBColor
+from pptx.enum.text import MSO_ANCHOR, MSO_AUTO_SIZE, PP_ALIGN
+from pptx.util import Inches, Pt
+
+logger = logging.getLogger()
+
+PPT_CACHE_SIZE = int(os.getenv("PPT_CACHE_SIZE", "32"))
+# Decks pre-generated at build time by utilities/ppt_prebuilder.py
+DECKS_DIRECTORY = os.path.join(os.path.dirname(__file__), "decks")
+
+_file_ids = {}
+
+
+def deck_key(song_number):
+    # Includes a digest of the content, so an edited song never reuses a deck
+    # or Telegram upload made from its old lyrics
+    content = (TITLES[song_number] + "\n" + SONGS[song_number]).encode("UTF-8")
+    return f"PPT {song_number} {hashlib.sha1(content).hexdigest()[:12]}"
+
+
+def stanzas(song_number):
+    """Returns the stanzas to put on slides, with the chorus repeated after
+    every verse."""
+    text = SONGS.get(song_number)
+    text = text.split("\n\n")
+    text.pop(0)
+    text = list(filter(None, text))
+
+    originallen = len(text)
+    chorus = None
+    for i in range(originallen):
+        stanza = text[i]
+        if stanza.startswith("Chorus:") or stanza.startswith("Refrain:"):
+            chorus = i
+            break
+    if chorus is not None:
+        i = chorus + 2
+        while True:
+            text.insert(i, stanza)
+            i += 2
+            if i > len(text):
+                break
+    return text
+
+
+def make_ppt(song_number):
+    prs = Presentation()
+    prs.slide_width = Inches(16)
+    prs.slide_height = Inches(9)
+
+    title = TITLES.get(song_number)
+    text = stanzas(song_number)
+
+    blank_slide_layout = prs.slide_layouts[6]
+    slide = prs.slides.add_slide(blank_slide_layout)
+    background = slide.background
+    fill = background.fill
+    fill.solid()
+    fill.fore_color.rgb = RGBColor(0, 0, 0)
+
+    txBox = slide.shapes.add_textbox(0, 0, Inches(16), Inches(9))
+    tf = txBox.text_frame
+    tf.vertical_anchor = MSO_ANCHOR.MIDDLE
+    p = tf.add_paragraph()
+    p.text = title + "\n(" + song_number + ")"
+    p.font.size = Pt(60)
+    p.font.bold = True
+    p.font.color.rgb = RGBColor(255, 255, 255)
+    p.alignment = PP_ALIGN.CENTER
+
+    for i in range(len(text)):
+        blank_slide_layout = prs.slide_layouts[6]
+        slide = prs.slides.add_slide(blank_slide_layout)
+        background = slide.background
+        fill = background.fill
+        fill.solid()
+        fill.fore_color.rgb = RGBColor(0, 0, 0)
+
+        txBox = slide.shapes.add_textbox(Inches(15), 0, Inches(1), Inches(1))
+        tf = txBox.text_frame
+        p = tf.add_paragraph()
+        p.text = "{}/{}".format(i + 1, len(text))
+        p.font.size = Pt(32)
+        p.font.color.rgb = RGBColor(255, 255, 255)
+
+        txBox = slide.shapes.add_textbox(0, 0, Inches(16), Inches(9))
+        tf = txBox.text_frame
+        tf.vertical_anchor = MSO_ANCHOR.MIDDLE
+        tf.word_wrap = True
+        tf.auto_size = MSO_AUTO_SIZE.SHAPE_TO_FIT_TEXT
+        p = tf.add_paragraph()
+        p.text = text[i].strip()
+        p.font.size = Pt(48)
+        if song_number.startswith("C "):
+            p.font.size = Pt(32)
+        p.font.bold = True
+        p.font.color.rgb = RGBColor(255, 255, 255)
+        p.alignment = PP_ALIGN.CENTER
+    pptxfile = BytesIO()
+    pptxfile.name = song_number + ".pptx"
+    prs.save(pptxfile)
+    pptxfile.seek(0)
+    return pptxfile
+
+
+# Fast path: the same deck make_ppt builds, written straight from XML strings.
+# The package parts that don't depend on the song come from an empty deck
+# saved once by python-pptx; only the slides and the lists that reference
+# them are generated per song.
+SLIDE_XML = (
+    "<?xml version='1.0' encoding='UTF-8' standalone='yes'?>\n"
+    '<p:sld xmlns:a="http://schemas.openxmlformats.org/drawingml/2006/main" '
+    'xmlns:p="http://schemas.openxmlformats.org/presentationml/2006/main" '
+    'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+    "<p:cSld><p:bg><p:bgPr><a:solidFill><a:srgbClr val=\"000000\"/></a:solidFill>"
+    "<a:effectLst/></p:bgPr></p:bg><p:spTree><p:nvGrpSpPr><p:cNvPr id=\"1\" name=\"\"/>"
+    "<p:cNvGrpSpPr/><p:nvPr/></p:nvGrpSpPr><p:grpSpPr/>{shapes}</p:spTree></p:cSld>"
+    "<p:clrMapOvr><a:masterClrMapping/></p:clrMapOvr></p:sld>"
+)
+TEXTBOX_XML = (
+    '<p:sp><p:nvSpPr><p:cNvPr id="{id}" name="TextBox {number}"/><p:cNvSpPr txBox="1"/>'
+    '<p:nvPr/></p:nvSpPr><p:spPr><a:xfrm><a:off x="{x}" y="0"/><a:ext cx="{cx}" cy="{cy}"/>'
+    '</a:xfrm><a:prstGeom prst="rect"><a:avLst/></a:prstGeom><a:noFill/></p:spPr>'
+    "<p:txBody><a:bodyPr {body}><a:spAutoFit/></a:bodyPr><a:lstStyle/><a:p/><a:p><a:pPr{align}>"
+    '<a:defRPr sz="{size}"{bold}><a:solidFill><a:srgbClr val="FFFFFF"/></a:solidFill>'
+    "</a:defRPr></a:pPr>{runs}</a:p></p:txBody></p:sp>"
+)
+SLIDE_RELS_XML = (
+    "<?xml version='1.0' encoding='UTF-8' standalone='yes'?>\n"
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/'
+    'relationships/slideLayout" Target="../slideLayouts/slideLayout7.xml"/></Relationships>'
+)
+SLIDE_REL_XML = (
+    '<Relationship Id="rId{rid}" Type="http://schemas.openxmlformats.org/officeDocument/2006/'
+    'relationships/slide" Target="slides/slide{n}.xml"/>'
+)
+SLIDE_CONTENT_TYPE_XML = (
+    '<Override PartName="/ppt/slides/slide{n}.xml" ContentType="application/'
+    'vnd.openxmlformats-officedocument.presentationml.slide+xml"/>'
+)
+FIRST_SLIDE_RID = 7  # the empty deck's presentation.xml.rels uses rId1-rId6
+FULL_WIDTH = Inches(16)
+FULL_HEIGHT = Inches(9)
+
+
+@lru_cache(maxsize=None)
+def template_parts():
+    prs = Presentation()
+    prs.slide_width = FULL_WIDTH
+    prs.slide_height = FULL_HEIGHT
+    pptxfile = BytesIO()
+    prs.save(pptxfile)
+    with zipfile.ZipFile(pptxfile) as z:
+        return [(name, z.read(name)) for name in z.namelist()]
+
+
+def runs_xml(text):
+    # Mirrors python-pptx's paragraph.text setter: lines become runs separated
+    # by line breaks, empty lines get no run, control characters are escaped
+    runs = []
+    for i, line in enumerate(re.split("\n|\v", text)):
+        if i > 0:
+            runs.append("<a:br/>")
+        if line:
+            line = re.sub(r"([\x00-\x08\x0B-\x1F])", lambda m: "_x%04X_" % ord(m.group(1)), line)
+            runs.append(f"<a:r><a:t>{escape(line)}</a:t></a:r>")
+    return "".join(runs)
+
+
+def textbox_xml(number, text, x, cx, cy, body, size, bold=False, centered=False):
+    return TEXTBOX_XML.format(
+        id=number + 1,
+        number=number,
+        x=x,
+        cx=cx,
+        cy=cy,
+        body=body,
+        align=' algn="ctr"' if centered else "",
+        size=size,
+        bold=' b="1"' if bold else "",
+        runs=runs_xml(text),
+    )
+
+
+def render_ppt(song_number):
+    """Returns the bytes of the deck make_ppt builds, without python-pptx."""
+    title = TITLES.get(song_number)
+    text = stanzas(song_number)
+    size = 3200 if song_number.startswith("C ") else 4800
+    slides = [
+        textbox_xml(
+            1, title + "\n(" + song_number + ")", 0, FULL_WIDTH, FULL_HEIGHT,
+            'wrap="none" anchor="ctr"', 6000, bold=True, centered=True,
+        )
+    ]
+    for i in range(len(text)):
+        slides.append(
+            textbox_xml(
+                1, "{}/{}".format(i + 1, len(text)), Inches(15), Inches(1), Inches(1),
+                'wrap="none"', 3200,
+            )
+            + textbox_xml(
+                2, text[i].strip(), 0, FULL_WIDTH, FULL_HEIGHT,
+                'wrap="square" anchor="ctr"', size, bold=True, centered=True,
+            )
+        )
+
+    numbers = range(1, len(slides) + 1)
+    slide_ids = "".join(
+        f'<p:sldId id="{255 + n}" r:id="rId{FIRST_SLIDE_RID - 1 + n}"/>' for n in numbers
+    )
+    slide_rels = "".join(SLIDE_REL_XML.format(rid=FIRST_SLIDE_RID - 1 + n, n=n) for n in numbers)
+    content_types = "".join(SLIDE_CONTENT_TYPE_XML.format(n=n) for n in numbers)
+
+    pptxfile = BytesIO()
+    with zipfile.ZipFile(pptxfile, "w", zipfile.ZIP_DEFLATED) as z:
+        for name, data in template_parts():
+            if name == "ppt/presentation.xml":
+                data = data.replace(
+                    b"</p:sldMasterIdLst>",
+                    b"</p:sldMasterIdLst><p:sldIdLst>" + slide_ids.encode() + b"</p:sldIdLst>",
+                )
+            elif name == "ppt/_rels/presentation.xml.rels":
+                data = data.replace(b"</Relationships>", slide_rels.encode() + b"</Relationships>")
+            elif name == "[Content_Types].xml":
+                data = data.replace(b"</Types>", content_types.encode() + b"</Types>")
+            z.writestr(name, data)
+        for n, shapes in zip(numbers, slides):
+            z.writestr(f"ppt/slides/slide{n}.xml", SLIDE_XML.format(shapes=shapes).encode("UTF-8"))
+            z.writestr(f"ppt/slides/_rels/slide{n}.xml.rels", SLIDE_RELS_XML)
+    return pptxfile.getvalue()
+
+
+@lru_cache(maxsize=PPT_CACHE_SIZE)
+def deck_bytes(song_number):
+    path = os.path.join(DECKS_DIRECTORY, deck_key(song_number) + ".pptx")
+    if os.path.exists(path):
+        with open(path, "rb") as f:
+            return f.read()
+    return render_ppt(song_number)
+
+
+def deck_file(song_number, data):
+    pptxfile = BytesIO(data)
+    pptxfile.name = song_number + ".pptx"
+    return pptxfile
+
+
+async def get_file_id(song_number):
+    """Returns the Telegram file_id of a deck already uploaded for this song,
+    or None if it has to be generated and uploaded."""
+    key = deck_key(song_number)
+    file_id = _file_ids.get(key)
+    if file_id is None:
+        try:
+            item = (await db.files.get_item(Key={"id": key})).get("Item")
+        except (BotoCoreError, ClientError):
+            # tsms_files is only a cache: generate and upload the deck instead
+            logger.exception("Reading the PPT file_id for %s failed", song_number)
+            return None
+        if item:
+            file_id = _file_ids[key] = item["file_id"]
+    return file_id
+
+
+async def save_file_id(song_number, file_id):
+    key = deck_key(song_number)
+    _file_ids[key] = file_id
+    try:
+        await db.files.put_item(Item={"id": key, "file_id": file_id})
+    except (BotoCoreError, ClientError):
+        # The deck was sent; the next container just uploads it again
+        logger.exception("Saving the PPT file_id for %s failed", song_number)
@@ -0,0 +1,85 @@
+# Runs the bot as a long-lived process on a container host, with the same
+# handlers as lambda_function but several updates processed at once.
+#
+# Usage: python lambda/server.py
+# Uses long polling unless WEBHOOK_URL is set, in which case it serves the
+# webhook itself on WEBHOOK_PORT (needs python-telegram-bot[webhooks]). A bot
+# token has either a webhook or polling, so starting in polling mode removes
+# the Lambda's webhook, and it has to be set again afterwards.
+# SIGINT/SIGTERM stop taking new updates, wait for the ones in progress and
+# flush the logs and metrics before exiting.
+
+import asyncio
+import logging
+import os
+
+import db
+import lambda_function
+import logs
+import telemetry
+import workers
+from telegram import Update
+from telegram.ext import Application
+
+CONCURRENT_UPDATES = int(os.getenv("CONCURRENT_UPDATES", "32"))
+LOG_FLUSH_INTERVAL = float(os.getenv("LOG_FLUSH_INTERVAL", "5"))  # seconds
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+
+_flusher = None
+
+
+async def flush_logs_periodically():
+    while True:
+        await asyncio.sleep(LOG_FLUSH_INTERVAL)
+        await logs.flush(lambda_function.log_sink)
+        db.report_user_cache()
+        telemetry.flush()
+
+
+async def post_init(bot_app):
+    global _flusher
+    _flusher = asyncio.create_task(flush_logs_periodically())
+
+
+async def post_shutdown(bot_app):
+    # Runs after every update in progress has finished
+    _flusher.cancel()
+    await logs.flush(lambda_function.log_sink)
+    db.report_user_cache()
+    telemetry.flush()
+    workers.shutdown()
+
+
+def build_app():
+    bot_app = (
+        Application.builder()
+        .token(lambda_function.BOT_TOKEN)
+        .concurrent_updates(CONCURRENT_UPDATES)
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
+    lambda_function.add_handlers(bot_app)
+    return bot_app
+
+
+def main():
+    logging.basicConfig(format="%(asctime)s %(levelname)s %(name)s: %(message)s", level=logging.INFO)
+    workers.start_processes()
+    bot_app = build_app()
+    if WEBHOOK_URL:
+        bot_app.run_webhook(
+            listen="0.0.0.0",
+            port=WEBHOOK_PORT,
+            webhook_url=WEBHOOK_URL,
+            secret_token=WEBHOOK_SECRET,
+            allowed_updates=Update.ALL_TYPES,
+        )
+    else:
+        bot_app.run_polling(allowed_updates=Update.ALL_TYPES)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+import marshal
+import mmap
+import os
+from collections.abc import Mapping
+
+# Layout: MAGIC, 8-byte little-endian header length, marshalled header
+# {table: {key: (offset, length)}}, then the marshalled values back to back.
+# Only the header is decoded on load; values are decoded on first access.
+MAGIC = b"TSMSSNAP"
+
+
+class Table(Mapping):
+    """Read-only view of one table in a snapshot file."""
+
+    def __init__(self, data, base, entries):
+        self._data = data
+        self._base = base
+        self._entries = entries
+        self._decoded = {}
+
+    def __getitem__(self, key):
+        try:
+            return self._decoded[key]
+        except KeyError:
+            pass
+        offset, length = self._entries[key]
+        start = self._base + offset
+        value = marshal.loads(self._data[start : start + length])
+        self._decoded[key] = value
+        return value
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __iter__(self):
+        return iter(self._entries)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class Shards:
+    """Directory of snapshot files, one per book, each holding the same set of
+    tables. A book's file is only opened the first time one of its keys is
+    looked up."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.names = sorted(
+            os.path.splitext(f)[0] for f in os.listdir(directory) if f.endswith(".bin")
+        )
+        self._loaded = {}
+
+    def load(self, name):
+        tables = self._loaded.get(name)
+        if tables is None:
+            tables = load(os.path.join(self.directory, name + ".bin"))
+            self._loaded[name] = tables
+        return tables
+
+    def table(self, name):
+        return ShardedTable(self, name)
+
+
+class ShardedTable(Mapping):
+    """Read-only view of one table across all shards, routed by the book
+    prefix of song number keys such as "HGG 12"."""
+
+    def __init__(self, shards, name):
+        self._shards = shards
+        self._name = name
+
+    def _table(self, key):
+        if not isinstance(key, str):
+            return None
+        book = key.split(" ", 1)[0]
+        if book not in self._shards.names:
+            return None
+        return self._shards.load(book)[self._name]
+
+    def __getitem__(self, key):
+        table = self._table(key)
+        if table is None:
+            raise KeyError(key)
+        return table[key]
+
+    def __contains__(self, key):
+        table = self._table(key)
+        return table is not None and key in table
+
+    def __iter__(self):
+        for book in self._shards.names:
+            yield from self._shards.load(book)[self._name]
+
+    def __len__(self):
+        return sum(len(self._shards.load(book)[self._name]) for book in self._shards.names)
+
+
+def load(path):
+    with open(path, "rb") as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if data[: len(MAGIC)] != MAGIC:
+        raise ValueError(f"{path} is not a snapshot file")
+    header_start = len(MAGIC) + 8
+    header_length = int.from_bytes(data[len(MAGIC) : header_start], "little")
+    base = header_start + header_length
+    header = marshal.loads(data[header_start:base])
+    return {name: Table(data, base, entries) for name, entries in header.items()}
+
+
+def write(path, tables):
+    header = {}
+    values = bytearray()
+    for name, table in tables.items():
+        entries = {}
+        for key, value in table.items():
+            encoded = marshal.dumps(value)
+            entries[key] = (len(values), len(encoded))
+            values += encoded
+        header[name] = entries
+    header = marshal.dumps(header)
+    with open(path, "wb") as f:
+        f.write(MAGIC)
+        f.write(len(header).to_bytes(8, "little"))
+        f.write(header)
+        f.write(values)
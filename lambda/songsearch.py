@@ -0,0 +1,216 @@
+import logging
+import os
+import time
+from collections import Counter, namedtuple
+from decimal import Decimal
+from functools import lru_cache
+
+import db
+import normalize
+import numpy
+import snapshot
+from botocore.exceptions import BotoCoreError, ClientError
+from cache import SONGS
+from lookup import SONGS_LOOKUP, TITLES_LOOKUP, VERSION
+from rapidfuzz import fuzz, process
+
+logger = logging.getLogger()
+
+# A title at least this similar (fuzz.ratio) to the query is taken as the
+# answer, the same as an exact title match
+TITLE_CONFIDENCE = 90
+LYRICS_CUTOFF = 85  # partial_ratio
+RESULTS_LIMIT = 10
+# Threads per cdist call. Searches already run side by side on
+# workers.threads, so a thread per core for each one would oversubscribe
+# the CPU.
+SCORER_WORKERS = 1
+
+SEARCH_CACHE_SIZE = int(os.getenv("SEARCH_CACHE_SIZE", "2048"))
+# Optional DynamoDB table (key "id") holding results for every container
+SEARCH_CACHE_TABLE = os.getenv("SEARCH_CACHE_TABLE")
+SEARCH_CACHE_TTL_SECONDS = 30 * 24 * 3600
+# Results for popular queries, built by utilities/cacheloader.py
+PRECOMPUTED_PATH = os.path.join(os.path.dirname(__file__), "search.bin")
+
+# stage is the one that produced the answer: number, title, fuzzy_title,
+# lyrics or none. timings maps each stage that ran to its milliseconds.
+Result = namedtuple("Result", "stage song_number results timings")
+
+
+@lru_cache(maxsize=None)
+def title_choices():
+    """Returns the normalized titles, the strings the query is compared with
+    and, for each of those strings, the index of the title it came from.
+    Bilingual titles are stored as "PINYIN  ENGLISH", so each half is also
+    compared on its own."""
+    titles = list(TITLES_LOOKUP)
+    variants = []
+    owners = []
+    for i, title in enumerate(titles):
+        for variant in dict.fromkeys([title] + title.split("  ")):
+            variant = variant.strip()
+            if variant:
+                variants.append(variant)
+                owners.append(i)
+    return titles, variants, numpy.array(owners)
+
+
+@lru_cache(maxsize=None)
+def title_of_song():
+    return {
+        song_number: i
+        for i, song_numbers in enumerate(TITLES_LOOKUP.values())
+        for song_number in song_numbers
+    }
+
+
+def exact(message, timings=None):
+    """The cheap stages: a song number, then an exact normalized title.
+    Returns None if neither matches."""
+    timings = {} if timings is None else timings
+    start = time.perf_counter()
+    if message in SONGS:
+        timings["number"] = (time.perf_counter() - start) * 1000
+        return Result("number", message, [], timings)
+    clean_message = normalize.search_text(message)
+    results = TITLES_LOOKUP.get(clean_message)
+    timings["title"] = (time.perf_counter() - start) * 1000
+    if results:
+        results = results.copy()
+        return Result("title", results.pop(0), results, timings)
+    return None
+
+
+def fuzzy(clean_message, timings=None):
+    """The scoring stages: every title at once with cdist, and only if none
+    is close enough, every song's lyrics. Lyric matches with
+    the same score are ranked by how close their title is to the query, then
+    TSMS first."""
+    timings = {} if timings is None else timings
+    if not clean_message:
+        return Result("none", None, [], timings)
+    start = time.perf_counter()
+    titles, variants, owners = title_choices()
+    variant_scores = process.cdist(
+        [clean_message],
+        variants,
+        scorer=fuzz.ratio,
+        dtype=numpy.uint8,
+        workers=SCORER_WORKERS,
+    )[0]
+    title_scores = numpy.zeros(len(titles), dtype=numpy.uint8)
+    numpy.maximum.at(title_scores, owners, variant_scores)
+    best = title_scores.max(initial=0)
+    timings["fuzzy_title"] = (time.perf_counter() - start) * 1000
+    if best >= TITLE_CONFIDENCE:
+        # Several titles can tie, e.g. an English title and the same words as
+        # half of a bilingual one; TSMS songs go first, as they do within a title
+        results = [
+            song_number
+            for i in numpy.flatnonzero(title_scores == best)
+            for song_number in TITLES_LOOKUP[titles[i]]
+        ]
+        results.sort(key=lambda song_number: not song_number.startswith("TSMS"))
+        return Result("fuzzy_title", results.pop(0), results, timings)
+
+    start = time.perf_counter()
+    song_numbers = list(SONGS_LOOKUP)
+    lyric_scores = process.cdist(
+        [clean_message],
+        list(SONGS_LOOKUP.values()),
+        scorer=fuzz.partial_ratio,
+        score_cutoff=LYRICS_CUTOFF,
+        workers=SCORER_WORKERS,
+    )[0]
+    title_of = title_of_song()
+    title_similarity = title_scores[[title_of[song_number] for song_number in song_numbers]]
+    other_book = numpy.array([not song_number.startswith("TSMS") for song_number in song_numbers])
+    # lexsort is stable and sorts by its last key first
+    order = numpy.lexsort((other_book, -title_similarity.astype(numpy.int16), -lyric_scores))
+    results = [
+        song_numbers[i] for i in order[:RESULTS_LIMIT] if lyric_scores[i] >= LYRICS_CUTOFF
+    ]
+    timings["lyrics"] = (time.perf_counter() - start) * 1000
+    return Result("lyrics" if results else "none", None, results, timings)
+
+
+def find(message):
+    """Runs every stage in order, stopping at the first that answers."""
+    timings = {}
+    return exact(message, timings) or fuzzy(normalize.search_text(message), timings)
+
+
+# Results only change when the song data does, which means a new deploy, so
+# entries never expire; VERSION in the shared table's keys does the same there
+result_cache = db.TTLCache(SEARCH_CACHE_SIZE, float("inf"))
+shared_results = db.AsyncTable(SEARCH_CACHE_TABLE) if SEARCH_CACHE_TABLE else None
+cache_stats = Counter()
+
+
+@lru_cache(maxsize=None)
+def precomputed():
+    if not os.path.exists(PRECOMPUTED_PATH):
+        return {}
+    tables = snapshot.load(PRECOMPUTED_PATH)
+    if tables["META"]["VERSION"] != VERSION:
+        logger.warning("Ignoring %s, built from different song data", PRECOMPUTED_PATH)
+        return {}
+    return tables["SEARCH_RESULTS"]
+
+
+def save_shared(item):
+    try:
+        db.table(SEARCH_CACHE_TABLE).put_item(Item=item)
+    except (BotoCoreError, ClientError):
+        logger.exception("Saving shared search results for %r failed", item["id"])
+
+
+async def search(clean_message, run):
+    """fuzzy() behind the result caches: this container's LRU, the results
+    precomputed at build time, then SEARCH_CACHE_TABLE if configured. run
+    executes fuzzy off the event loop on a miss."""
+    start = time.perf_counter()
+    entry = result_cache.get(clean_message)
+    tier = "memory"
+    if entry is None:
+        tier = "precomputed"
+        entry = precomputed().get(clean_message)
+    if entry is None and shared_results is not None and clean_message:
+        tier = "shared"
+        try:
+            item = (await shared_results.get_item(Key={"id": f"{VERSION} {clean_message}"})).get("Item")
+        except (BotoCoreError, ClientError):
+            # The shared table is only a cache: compute the results instead
+            logger.exception("Reading shared search results for %r failed", clean_message)
+            item = None
+        if item:
+            entry = (item["stage"], item.get("song_number"), item["results"])
+    if entry is None:
+        tier = "computed"
+        result = await run(fuzzy, clean_message)
+        entry = (result.stage, result.song_number, result.results)
+        if shared_results is not None and clean_message:
+            item = {
+                "id": f"{VERSION} {clean_message}",
+                "stage": result.stage,
+                "results": result.results,
+                "ttl": Decimal(int(time.time()) + SEARCH_CACHE_TTL_SECONDS),
+            }
+            if result.song_number:
+                item["song_number"] = result.song_number
+            # Saving is for other containers, so the reply doesn't wait for it
+            db._executor.submit(save_shared, item)
+    else:
+        stage, song_number, results = entry
+        result = Result(stage, song_number, list(results), {tier: (time.perf_counter() - start) * 1000})
+    if tier != "memory":
+        result_cache.set(clean_message, entry)
+
+    cache_stats[tier] += 1
+    total = sum(cache_stats.values())
+    logger.info(
+        "SEARCH_CACHE %s, hit rate %.1f%% of %d (%s)",
+        tier, 100 * (total - cache_stats["computed"]) / total, total, dict(cache_stats),
+    )
+    return result
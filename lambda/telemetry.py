@@ -0,0 +1,151 @@
+import functools
+import inspect
+import json
+import os
+import sys
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+# Per-stage latency histograms and call/error counters, emitted as CloudWatch
+# Embedded Metric Format lines: CloudWatch Logs turns each line into metrics
+# with no API calls. Each stage gets <stage>.Latency, .Calls and .Errors, both
+# overall and by Start (cold or warm), so p50/p99 by stage come from Latency.
+# count() adds plain counters, such as cache hits, alongside them.
+METRICS_NAMESPACE = os.getenv("METRICS_NAMESPACE", "newtsmsbot")
+# 0 swaps the EMF output for NullSink
+TELEMETRY = os.getenv("TELEMETRY", "1") != "0"
+# EMF allows at most 100 values per metric, and 100 metrics per directive
+MAX_VALUES = 100
+
+# The first flush in a container ends its cold start; every later update is warm
+start = "cold"
+# stage: Counter of latencies, in milliseconds rounded to 2 significant digits
+latencies = defaultdict(Counter)
+calls = Counter()
+errors = Counter()
+counts = Counter()
+
+
+class EMFSink:
+    """Prints each document as one line on stdout, which Lambda sends to
+    CloudWatch Logs."""
+
+    def write(self, document):
+        sys.stdout.write(json.dumps(document, separators=(",", ":")) + "\n")
+        sys.stdout.flush()
+
+
+class NullSink:
+    """Drops everything; for tests and local runs."""
+
+    def write(self, document):
+        pass
+
+
+sink = EMFSink() if TELEMETRY else NullSink()
+
+
+def record(stage, milliseconds, failed=False):
+    latencies[stage][float(f"{milliseconds:.2g}")] += 1
+    calls[stage] += 1
+    if failed:
+        errors[stage] += 1
+
+
+def count(metric, value=1):
+    counts[metric] += value
+
+
+@contextmanager
+def timer(stage):
+    """Records the time spent in the with block under stage, counting it as
+    an error if the block raises."""
+    started = time.perf_counter()
+    failed = False
+    try:
+        yield
+    except BaseException:
+        failed = True
+        raise
+    finally:
+        record(stage, (time.perf_counter() - started) * 1000, failed)
+
+
+def timed(stage):
+    """timer() as a decorator, for both plain and async functions."""
+
+    def decorator(fn):
+        if inspect.iscoroutinefunction(fn):
+
+            @functools.wraps(fn)
+            async def wrapper(*args, **kwargs):
+                with timer(stage):
+                    return await fn(*args, **kwargs)
+
+        else:
+
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                with timer(stage):
+                    return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def documents(timestamp):
+    """One document with every stage's Latency, Calls and Errors and every
+    counter, then as many more as it takes for the latency values past the
+    first MAX_VALUES of a stage."""
+    values = {
+        stage: [value for value, count in sorted(latencies[stage].items()) for _ in range(count)]
+        for stage in sorted(calls)
+    }
+    first = True
+    while first or any(values.values()):
+        document = {"Start": start}
+        metrics = []
+        for stage in list(values):
+            if values[stage]:
+                document[f"{stage}.Latency"] = values[stage][:MAX_VALUES]
+                values[stage] = values[stage][MAX_VALUES:]
+                metrics.append({"Name": f"{stage}.Latency", "Unit": "Milliseconds"})
+            if first:
+                document[f"{stage}.Calls"] = calls[stage]
+                document[f"{stage}.Errors"] = errors[stage]
+                metrics.append({"Name": f"{stage}.Calls", "Unit": "Count"})
+                metrics.append({"Name": f"{stage}.Errors", "Unit": "Count"})
+        if first:
+            for metric in sorted(counts):
+                document[metric] = counts[metric]
+                metrics.append({"Name": metric, "Unit": "Count"})
+        first = False
+        if not metrics:
+            return
+        document["_aws"] = {
+            "Timestamp": timestamp,
+            # At most MAX_VALUES metrics per directive
+            "CloudWatchMetrics": [
+                {
+                    "Namespace": METRICS_NAMESPACE,
+                    "Dimensions": [["Start"], []],
+                    "Metrics": metrics[i : i + MAX_VALUES],
+                }
+                for i in range(0, len(metrics), MAX_VALUES)
+            ],
+        }
+        yield document
+
+
+def flush():
+    """Writes everything recorded since the last flush to sink and resets."""
+    global start
+    for document in documents(int(time.time() * 1000)):
+        sink.write(document)
+    latencies.clear()
+    calls.clear()
+    errors.clear()
+    counts.clear()
+    start = "warm"
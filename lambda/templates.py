@@ -66,3 +66,5 @@ Search by typing any of the following:
 <b>Getty Music</b> (G)
 <b>Sovereign Grace Music</b> (SGM)
 """
+
+busy = "The bot is very busy right now, please try again in a moment"
@@ -0,0 +1,73 @@
+import asyncio
+import functools
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+# CPU-heavy handler work runs off the event loop, so that one slow request
+# doesn't hold up the other updates. rapidfuzz releases the GIL while it
+# scores, so fuzzy search only needs threads; PPT generation is pure Python
+# and needs processes to run in parallel.
+CPU_WORKERS = int(os.getenv("CPU_WORKERS", str(os.cpu_count() or 1)))
+# Process pools need shared memory that Lambda doesn't provide, so only
+# server.py starts one; until then process work runs on the thread pool
+PROCESS_WORKERS = int(os.getenv("PROCESS_WORKERS", str(os.cpu_count() or 1)))
+# Jobs allowed to wait or run per pool before new ones are turned away
+MAX_PENDING_JOBS = int(os.getenv("MAX_PENDING_JOBS", "64"))
+
+
+class Busy(Exception):
+    """Raised instead of queueing a job when its pool is already full."""
+
+
+class Pool:
+    def __init__(self, executor, max_pending=MAX_PENDING_JOBS):
+        self.executor = executor
+        self.max_pending = max_pending
+        self.pending = 0
+
+    async def run(self, fn, *args, **kwargs):
+        # pending is only touched from the event loop thread, so needs no lock
+        if self.pending >= self.max_pending:
+            raise Busy()
+        self.pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, functools.partial(fn, *args, **kwargs))
+        finally:
+            self.pending -= 1
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+
+threads = Pool(ThreadPoolExecutor(max_workers=CPU_WORKERS, thread_name_prefix="cpu"))
+processes = threads
+
+
+def _preload():
+    # Runs once in each worker process, so requests don't pay for loading the
+    # song snapshots and the PPT template
+    import ppt
+
+    ppt.template_parts()
+
+
+def start_processes(workers=PROCESS_WORKERS):
+    global processes
+    if workers < 1 or processes is not threads:
+        return
+    # spawn rather than fork: the server process already has running threads,
+    # whose locks a forked child would inherit in whatever state they were in
+    executor = ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_preload,
+    )
+    processes = Pool(executor)
+
+
+def shutdown():
+    threads.shutdown()
+    if processes is not threads:
+        processes.shutdown()
@@ -0,0 +1,64 @@
+import asyncio
+import random
+import sys
+import time
+from collections import deque
+
+sys.path.insert(0, "./lambda")
+
+from broadcast import Broadcaster
+from telegram.error import RetryAfter
+
+MEMBERS = (30, 100, 300)
+LATENCY = 0.05  # simulated Bot API round trip, in seconds
+RANDOM_429_RATE = 0.02
+
+
+class FakeBot:
+    """Answers send_message like the Bot API under load: more than 30 sends in
+    any one-second window, plus a small random share of requests, get a 429."""
+
+    def __init__(self):
+        self.sent = deque()
+        self.rejected = 0
+        self.delivered = set()
+        self.rng = random.Random(0)
+
+    async def send_message(self, chat_id, **kwargs):
+        await asyncio.sleep(LATENCY)
+        now = time.monotonic()
+        while self.sent and self.sent[0] <= now - 1:
+            self.sent.popleft()
+        if len(self.sent) >= 30 or self.rng.random() < RANDOM_429_RATE:
+            self.rejected += 1
+            raise RetryAfter(1)
+        self.sent.append(now)
+        self.delivered.add(chat_id)
+
+
+async def unbounded(bot, members):
+    # What GROUP_SEND did before: one gather, no limits, no retries
+    async def send(chat_id):
+        try:
+            await bot.send_message(chat_id=chat_id)
+        except RetryAfter:
+            pass
+
+    await asyncio.gather(*(send(chat_id) for chat_id in members))
+
+
+async def scheduled(bot, members):
+    await Broadcaster().broadcast(members, lambda chat_id: bot.send_message(chat_id=chat_id))
+
+
+for size in MEMBERS:
+    members = list(range(size))
+    for label, run in (("unbounded", unbounded), ("broadcast", scheduled)):
+        bot = FakeBot()
+        start = time.perf_counter()
+        asyncio.run(run(bot, members))
+        elapsed = time.perf_counter() - start
+        print(
+            f"{label:<10} {size:>4} members  delivered {len(bot.delivered):>4}  "
+            f"429s {bot.rejected:>4}  {elapsed:6.2f} s"
+        )
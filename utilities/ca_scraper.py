@@ -1,42 +1,25 @@
-import requests
-from bs4 import BeautifulSoup
 from unidecode import unidecode
 
+import scraper
+
 baseurl = "https://cityalight.com"
-headers = {
-    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/145.0.0.0 Safari/537.36"
-}
 
-url = baseurl + "/resources/"
-req = requests.get(url, headers=headers)
-soup = BeautifulSoup(req.content, "html.parser")
-soup = soup.find_all("div", class_="album")
-soup.reverse()
+soup = scraper.page(baseurl + "/resources/")
+albums = soup.find_all("div", class_="album")
+albums.reverse()
 
 songs = []
 
-for album in soup:
+for album in albums:
     for link in album.find_all("a", href=True):
         link = link.attrs.get("href").replace(baseurl, "")
         if link.startswith("/song/") and link not in songs:
             songs.append(link)
+soup.decompose()
 
-counter = 1
-
-book = open("./books/CA.txt", "w+")
-media = open("./media/ca_links.txt", "w+")
 
-for song in songs:
-    url = baseurl + song
-    req = requests.get(url, headers=headers)
-    soup = BeautifulSoup(req.content, "html.parser")
-
-    number = str(counter)
+def extract(soup, url):
     title = unidecode(soup.find("div", class_="album-title").text.strip())
-    print(title)
-
-    book.write(number + " " + title.upper())
-    book.write("\n")
     lyrics = soup.select_one(
         '[class^="et_pb_module et_pb_text et_pb_text_7"]'
     ) or soup.select_one('[class^="et_pb_module et_pb_text et_pb_text_6"]')
@@ -46,21 +29,26 @@ for song in songs:
     lyrics = lyrics.replace("æ", "'")
     if "MANDARIN" not in title.upper():
         lyrics = unidecode(lyrics)
-    book.write(lyrics)
-    book.write("\n")
-
-    media.write(number)
-    media.write("\n")
-    links = soup.find("div", class_="album")
-    for link in links.find_all("a", href=True):
+    links = []
+    for link in soup.find("div", class_="album").find_all("a", href=True):
         if link.text and link.attrs.get("href") != "#":
-            media.write(unidecode(link.text))
-            media.write("|")
-            media.write(link.attrs.get("href"))
-            media.write("\n")
-    media.write("\n")
+            links.append((unidecode(link.text), link.attrs.get("href")))
+    return title, lyrics, links
 
-    counter += 1
 
-book.close()
-media.close()
+catalogue = scraper.Catalogue(
+    "./media/ca_songs.json", {"./books/CA.txt": r"^(\d+) ", "./media/ca_links.txt": r"^(\d+)$"}
+)
+urls = {song: baseurl + song for song in songs}
+for song, digest, (title, lyrics, links) in scraper.scrape_changed(urls, extract, catalogue.digests()):
+    number = str(catalogue.number(song, title))
+    print(title)
+    catalogue.update(
+        song,
+        digest,
+        number + " " + title.upper() + "\n" + lyrics + "\n",
+        number + "\n" + "".join(text + "|" + href + "\n" for text, href in links) + "\n",
+    )
+catalogue.save()
+
+scraper.report()
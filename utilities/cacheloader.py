@@ -1,200 +1,395 @@
+import argparse
+import hashlib
 import json
+import marshal
 import os
 import re
-from collections import defaultdict
-
-from unidecode import unidecode
-
-f = open("./lambda/cache.py", "w", encoding="UTF-8")
-
-global songs
-songs = {}
-global titles
-titles = {}
-number = re.compile("^\d+ ")
-for filename in (x.name for x in os.scandir("./books") if x.is_file()):
-    filepath = "./books/" + filename
-    with open(filepath, "r", encoding="UTF8") as book:
-        filename = filename.split(".")
-        bookname = filename[0]
-        print("Loading", bookname)
-        song_number = None
-        song_lyrics = ""
-        for line in book:
-            if number.search(line):
-                if song_number != None:
-                    song_lyrics = song_lyrics.strip()
-                    songs[song_number] = song_lyrics
-                    song_lyrics = ""
-                song_lyrics += bookname + " " + line
-                line = line.split()
-                song_number = bookname + " " + str(line.pop(0))
-                song_title = " ".join(line)
-                titles[song_number] = song_title
-            else:
-                song_lyrics += line
-        song_lyrics = song_lyrics.strip()
-        songs[song_number] = song_lyrics
-
-f.write("TITLES = " + json.dumps(titles, ensure_ascii=False) + "\n")
-f.write("SONGS = " + json.dumps(songs, ensure_ascii=False) + "\n")
-
-global chords
-chords = {}
-number = re.compile("^\d")
-with open("./media/tsms_chords.txt", "r", encoding="UTF8") as tsms_chords_file:
-    print("Loading Chords")
-    song_number = None
-    song_lyrics = ""
-    for line in tsms_chords_file:
-        if number.search(line):
-            if song_number != None:
-                song_lyrics = song_lyrics.strip()
-                chords[song_number] = song_lyrics
-                song_lyrics = ""
-            song_lyrics += "TSMS " + line
-            line = line.split()
-            song_number = "TSMS " + str(line.pop(0))
-        else:
-            song_lyrics += line
-    song_lyrics = song_lyrics.strip()
-    chords[song_number] = song_lyrics
-
-with open("./media/cm_chords.txt", "r", encoding="UTF8") as cm_chords_file:
-    print("Loading CM Chords")
+import sys
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, "./lambda")
+
+import normalize
+import snapshot
+
+# Each source file is parsed into an intermediate artifact in BUILD_DIRECTORY,
+# named by a digest of the file and of the code that parses it, so unchanged
+# sources are never parsed again. Outputs are only rewritten when the
+# digest of their inputs differs from the one in the manifest.
+BUILD_DIRECTORY = "./build/cacheloader"
+MANIFEST = os.path.join(BUILD_DIRECTORY, "manifest.json")
+BUILDER_FILES = ("./utilities/cacheloader.py", "./lambda/normalize.py", "./lambda/snapshot.py")
+
+BOOK_NUMBER = re.compile(r"\d+ ")
+CHORDS_NUMBER = re.compile(r"\d")
+
+
+def numbered_records(lines, bookname, number):
+    """Yields (song_number, title, body) for files where each song starts
+    with a "<number> <title>" line. The body is the song from that line on,
+    prefixed with the book name, the way the lambda shows it."""
     song_number = None
-    song_lyrics = ""
-    for line in cm_chords_file:
-        if number.search(line):
-            if song_number != None:
-                song_lyrics = song_lyrics.strip()
-                chords[song_number] = song_lyrics
-                song_lyrics = ""
-            song_lyrics += "CM " + line
-            line = line.split()
-            song_number = "CM " + str(line.pop(0))
-        else:
-            song_lyrics += line
-    song_lyrics = song_lyrics.strip()
-    chords[song_number] = song_lyrics
-
-f.write("CHORDS = " + json.dumps(chords, ensure_ascii=False) + "\n")
-
-global scores
-scores = {}
-with open("./media/scores.txt", "r", encoding="UTF8") as scores_file:
-    print("Loading Scores")
-    for line in scores_file:
-        line = line.strip()
-        line = line.split("@")
-        reference = line[1]
-        line = line[0]
-        line = line.split("_")
-        number = line[0]
-        scores.setdefault(number, []).append(reference)
-
-f.write("SCORES = " + json.dumps(scores, ensure_ascii=False) + "\n")
-
-global mp3
-mp3 = {}
-with open("./media/mp3.txt", "r", encoding="UTF8") as mp3_file:
-    print("Loading MP3")
-    for line in mp3_file:
-        line = line.strip()
-        line = line.split("@")
-        reference = line[1]
-        line = line[0]
-        line = line.split("_")
-        number = line[0]
-        mp3.setdefault(number, []).append(reference)
-
-f.write("MP3 = " + json.dumps(mp3, ensure_ascii=False) + "\n")
-
-global piano
-piano = {}
-with open("./media/wilds_piano.txt", "r", encoding="UTF8") as piano_file:
-    print("Loading Piano")
-    for line in piano_file:
-        line = line.strip()
-        line = line.split("@")
-        reference = line[1]
-        number = line[0]
-        piano[number] = reference
-
-f.write("PIANO = " + json.dumps(piano, ensure_ascii=False) + "\n")
-
-global videos
-videos = {}
-with open('./media/videos.txt', 'r', encoding='UTF8') as videos_file:
-    print("Loading Videos")
-    for line in videos_file:
+    for line in lines:
+        if number.match(line):
+            if song_number is not None:
+                yield song_number, title, "".join(body).strip()
+            fields = line.split()
+            song_number = bookname + " " + fields[0]
+            title = " ".join(fields[1:])
+            body = [bookname, " ", line]
+        elif song_number is not None:
+            body.append(line)
+    if song_number is not None:
+        yield song_number, title, "".join(body).strip()
+
+
+def field_records(lines):
+    """Yields (key, "", value) for files of "<key>@<value>" lines."""
+    for line in lines:
         line = line.strip()
-        line = line.split('@')
-        reference = line[1]
-        number = line[0].upper().strip('0123456789-')
-        videos.setdefault(number, []).append(reference)
+        if line:
+            key, value = line.split("@")[:2]
+            yield key, "", value
 
-f.write("VIDEOS = " + json.dumps(videos, ensure_ascii=False) + "\n")
 
-global ca_links
-ca_links = {}
-with open("./media/ca_links.txt", "r", encoding="UTF8") as ca_links_file:
-    print("Loading CA Links")
+def block_records(lines, bookname):
+    """Yields (song_number, "", lines) for files of blank-line separated
+    blocks, each a song number line followed by "<text>|<href>" lines."""
     song_number = None
-    links = {}
-    for line in ca_links_file:
+    body = []
+    for line in lines:
         line = line.strip()
-        if not line and song_number != None:
-            ca_links[song_number] = links
+        if not line and song_number is not None:
+            yield song_number, "", body
             song_number = None
-            links = {}
+            body = []
         elif line.isnumeric():
-            song_number = "CA " + line
-        else:
-            line = line.split("|")
-            href = line[1]
-            text = line[0]
-            links[text] = href
-
-f.write("CA_LINKS = " + json.dumps(ca_links, ensure_ascii=False) + "\n")
-
-global sgm_links
-sgm_links = {}
-with open("./media/sgm_links.txt", "r", encoding="UTF8") as sgm_links_file:
-    print("Loading SGM Links")
-    song_number = None
-    links = {}
-    for line in sgm_links_file:
-        line = line.strip()
-        if not line and song_number != None:
-            sgm_links[song_number] = links
-            song_number = None
+            song_number = bookname + " " + line
+        elif line:
+            body.append(line)
+
+
+def parse_book(path, bookname):
+    songs = {}
+    titles = {}
+    with open(path, "r", encoding="UTF8") as book:
+        for song_number, title, body in numbered_records(book, bookname, BOOK_NUMBER):
+            songs[song_number] = body
+            titles[song_number] = title
+    return {
+        "SONGS": songs,
+        "TITLES": titles,
+        "SONGS_LOOKUP": {
+            song_number: normalize.search_text(song_lyrics)
+            for song_number, song_lyrics in songs.items()
+        },
+    }
+
+
+def parse_chords(path, bookname):
+    with open(path, "r", encoding="UTF8") as chords_file:
+        records = numbered_records(chords_file, bookname, CHORDS_NUMBER)
+        return {"CHORDS": {song_number: body for song_number, _, body in records}}
+
+
+def parse_references(path, table):
+    references = {}
+    with open(path, "r", encoding="UTF8") as references_file:
+        for key, _, reference in field_records(references_file):
+            # HOG 2_2 is the second page of HOG 2
+            references.setdefault(key.split("_")[0], []).append(reference)
+    return {table: references}
+
+
+def parse_piano(path):
+    with open(path, "r", encoding="UTF8") as piano_file:
+        return {"PIANO": {key: reference for key, _, reference in field_records(piano_file)}}
+
+
+def parse_videos(path):
+    videos = {}
+    with open(path, "r", encoding="UTF8") as videos_file:
+        for key, _, reference in field_records(videos_file):
+            videos.setdefault(key.upper().strip("0123456789-"), []).append(reference)
+    return {"VIDEOS": videos}
+
+
+def parse_links(path, bookname, table):
+    all_links = {}
+    with open(path, "r", encoding="UTF8") as links_file:
+        for song_number, _, lines in block_records(links_file, bookname):
             links = {}
-        elif line.isnumeric():
-            song_number = "SGM " + line
-        else:
-            line = line.split("|")
-            href = line[1]
-            text = line[0]
-            links[text] = href
-
-f.write("SGM_LINKS = " + json.dumps(sgm_links, ensure_ascii=False) + "\n")
-
-d = open("./lambda/lookup.py", "w", encoding="UTF-8")
-alpha = re.compile("[^a-zA-Z ]")
-titles_decoded = defaultdict(list)
-songs_decoded = {}
-for song_number, song_title in titles.items():
-    title = unidecode(song_title).strip().upper()
-    title = alpha.sub("", title)
-    if song_number.startswith("TSMS"):
-        titles_decoded[title].insert(0, song_number)
+            for line in lines:
+                text, href = line.split("|")[:2]
+                links[text] = href
+            all_links[song_number] = links
+    return {table: all_links}
+
+
+BOOKS = [filename.split(".")[0] for filename in sorted(os.listdir("./books"))]
+BOOK_SOURCES = ["./books/" + bookname + ".txt" for bookname in BOOKS]
+# path: (parser, extra arguments)
+SOURCES = {path: (parse_book, (bookname,)) for bookname, path in zip(BOOKS, BOOK_SOURCES)}
+SOURCES.update(
+    {
+        "./media/tsms_chords.txt": (parse_chords, ("TSMS",)),
+        "./media/cm_chords.txt": (parse_chords, ("CM",)),
+        "./media/scores.txt": (parse_references, ("SCORES",)),
+        "./media/mp3.txt": (parse_references, ("MP3",)),
+        "./media/wilds_piano.txt": (parse_piano, ()),
+        "./media/videos.txt": (parse_videos, ()),
+        "./media/ca_links.txt": (parse_links, ("CA", "CA_LINKS")),
+        "./media/sgm_links.txt": (parse_links, ("SGM", "SGM_LINKS")),
+    }
+)
+CHORD_SOURCES = {"TSMS": "./media/tsms_chords.txt", "CM": "./media/cm_chords.txt"}
+MEDIA_SOURCES = [
+    path for path in SOURCES if path.startswith("./media/") and path not in CHORD_SOURCES.values()
+]
+
+
+def build_artifact(source):
+    """Parses (parser, path, arguments, artifact path) and marshals the tables
+    to the artifact path. Runs in the worker processes, which hand back
+    nothing: marshal.load is far cheaper than pickling the tables across."""
+    source_parser, path, parser_args, artifact_path = source
+    tables = source_parser(path, *parser_args)
+    directory, name = os.path.split(artifact_path)
+    for filename in os.listdir(directory):
+        # Artifacts of earlier versions of the same source
+        if filename.startswith(name.rsplit("-", 1)[0] + "-"):
+            os.remove(os.path.join(directory, filename))
+    with open(artifact_path, "wb") as f:
+        marshal.dump(tables, f)
+
+
+def build_artifacts(sources, jobs):
+    """build_artifact() for each source, in parallel when jobs > 1. The
+    largest files start first so one big book isn't left running alone at
+    the end."""
+    sources = sorted(sources, key=lambda source: -os.path.getsize(source[1]))
+    if jobs > 1 and len(sources) > 1:
+        with ProcessPoolExecutor(min(jobs, len(sources))) as pool:
+            list(pool.map(build_artifact, sources))
     else:
-        titles_decoded[title].append(song_number)
-for song_number, song_lyrics in songs.items():
-    lyrics = unidecode(song_lyrics).replace("\n", " ").strip().upper()
-    lyrics = alpha.sub("", lyrics)
-    songs_decoded[song_number] = lyrics
-
-d.write("TITLES_LOOKUP = " + json.dumps(titles_decoded, ensure_ascii=False) + "\n")
-d.write("SONGS_LOOKUP = " + json.dumps(songs_decoded, ensure_ascii=False) + "\n")
+        for source in sources:
+            build_artifact(source)
+
+
+def file_digest(path):
+    with open(path, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def combined_digest(digests):
+    return hashlib.sha1("\n".join(digests).encode("UTF-8")).hexdigest()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Builds the lambda's song snapshots from ./books")
+    parser.add_argument(
+        "--check",
+        action="store_true",
+        help="only report whether the snapshots are up to date; exits 1 if not",
+    )
+    parser.add_argument(
+        "--precompute-searches",
+        type=int,
+        default=0,
+        metavar="N",
+        help="also precompute results for the N most frequent searches in tsms_logs",
+    )
+    parser.add_argument("--force", action="store_true", help="rebuild everything")
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=os.cpu_count() or 1,
+        metavar="N",
+        help="parse changed sources in N processes (default: one per CPU)",
+    )
+    args = parser.parse_args()
+
+    builder = combined_digest(file_digest(path) for path in BUILDER_FILES)
+    source_digests = {path: combined_digest([builder, file_digest(path)]) for path in SOURCES}
+
+    # output: the sources it is built from
+    outputs = {}
+    for bookname, path in zip(BOOKS, BOOK_SOURCES):
+        outputs["./lambda/books/" + bookname + ".bin"] = [path] + (
+            [CHORD_SOURCES[bookname]] if bookname in CHORD_SOURCES else []
+        )
+    outputs["./lambda/cache.bin"] = BOOK_SOURCES + MEDIA_SOURCES
+    outputs["./lambda/lookup.bin"] = BOOK_SOURCES
+    input_digests = {
+        output: combined_digest(source_digests[path] for path in paths)
+        for output, paths in outputs.items()
+    }
+
+    manifest = {}
+    if os.path.exists(MANIFEST) and not args.force:
+        with open(MANIFEST, "r", encoding="UTF8") as f:
+            manifest = json.load(f)
+
+    def up_to_date(output):
+        entry = manifest.get(output)
+        return (
+            entry is not None
+            and entry["inputs"] == input_digests[output]
+            and os.path.exists(output)
+            and file_digest(output) == entry["output"]
+        )
+
+    stale = [output for output in outputs if not up_to_date(output)]
+    os.makedirs("./lambda/books", exist_ok=True)
+    # Shards of books whose source has been removed
+    extra = sorted(
+        "./lambda/books/" + filename
+        for filename in os.listdir("./lambda/books")
+        if filename.endswith(".bin") and "./lambda/books/" + filename not in outputs
+    )
+
+    if args.check:
+        for output in stale:
+            print("Out of date:", output)
+        for output in extra:
+            print("Not built from any source:", output)
+        if stale or extra:
+            sys.exit(1)
+        print("Up to date")
+        sys.exit(0)
+
+    directory = os.path.join(BUILD_DIRECTORY, "sources")
+
+    def artifact_path(path):
+        name = os.path.basename(path).split(".")[0]
+        return os.path.join(directory, f"{name}-{source_digests[path][:12]}.marshal")
+
+    # Every source the stale outputs need that has no artifact yet is parsed
+    # in one batch, so a full rebuild is spread over --jobs processes
+    needed = dict.fromkeys(path for output in stale for path in outputs[output])
+    unparsed = [path for path in needed if not os.path.exists(artifact_path(path))]
+    for path in unparsed:
+        print("Loading", path)
+    os.makedirs(directory, exist_ok=True)
+    build_artifacts(
+        [(SOURCES[path][0], path, SOURCES[path][1], artifact_path(path)) for path in unparsed],
+        args.jobs,
+    )
+
+    artifacts = {}
+
+    def artifact(path):
+        if path not in artifacts:
+            with open(artifact_path(path), "rb") as f:
+                artifacts[path] = marshal.load(f)
+        return artifacts[path]
+
+    def merged(table, paths):
+        merged_table = {}
+        for path in paths:
+            merged_table.update(artifact(path)[table])
+        return merged_table
+
+    def written(output, tables):
+        snapshot.write(output, tables)
+        manifest[output] = {"inputs": input_digests[output], "output": file_digest(output)}
+
+    if stale:
+        print("Rebuilding", ", ".join(stale))
+    else:
+        print("Snapshots are up to date")
+
+    # Lyrics, chords and their search text are sharded per book so the lambda
+    # only maps the books a request actually touches
+    for output in extra:
+        os.remove(output)
+    for bookname in BOOKS:
+        output = "./lambda/books/" + bookname + ".bin"
+        if output in stale:
+            book = artifact("./books/" + bookname + ".txt")
+            chords = artifact(CHORD_SOURCES[bookname])["CHORDS"] if bookname in CHORD_SOURCES else {}
+            written(
+                output,
+                {"SONGS": book["SONGS"], "CHORDS": chords, "SONGS_LOOKUP": book["SONGS_LOOKUP"]},
+            )
+
+    if "./lambda/cache.bin" in stale:
+        tables = {"TITLES": merged("TITLES", BOOK_SOURCES)}
+        for path in MEDIA_SOURCES:
+            tables.update(artifact(path))
+        written(
+            "./lambda/cache.bin",
+            {
+                table: tables[table]
+                for table in ("TITLES", "SCORES", "MP3", "PIANO", "VIDEOS", "CA_LINKS", "SGM_LINKS")
+            },
+        )
+
+    if "./lambda/lookup.bin" in stale:
+        songs_decoded = merged("SONGS_LOOKUP", BOOK_SOURCES)
+        titles_decoded = defaultdict(list)
+        for song_number, song_title in merged("TITLES", BOOK_SOURCES).items():
+            title = normalize.search_text(song_title)
+            if song_number.startswith("TSMS"):
+                titles_decoded[title].insert(0, song_number)
+            else:
+                titles_decoded[title].append(song_number)
+        version = hashlib.sha1(repr((titles_decoded, songs_decoded)).encode("UTF-8")).hexdigest()[:12]
+
+        print("Building Lookup")
+        written(
+            "./lambda/lookup.bin",
+            {
+                "META": {"VERSION": version},
+                "TITLES_LOOKUP": titles_decoded,
+            },
+        )
+
+    os.makedirs(BUILD_DIRECTORY, exist_ok=True)
+    manifest = {output: entry for output, entry in manifest.items() if output in outputs}
+    with open(MANIFEST, "w", encoding="UTF8") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+
+    if args.precompute_searches:
+        precompute_searches(args.precompute_searches)
+
+
+def precompute_searches(limit):
+    # Imported only now, so that they load the snapshots just written
+    import boto3
+    import songsearch
+    from boto3.dynamodb.conditions import Attr
+    from lookup import VERSION
+
+    print("Counting searches in tsms_logs")
+    table = boto3.resource("dynamodb").Table("tsms_logs")
+    searches = Counter()
+    scan = {
+        # One of these is logged per search; HINT and ALSO_FOUND repeat them
+        "FilterExpression": Attr("event").is_in(["SEARCH_HIT", "SEARCH_RESULTS", "SEARCH_NONE"]),
+        "ProjectionExpression": "#q",
+        "ExpressionAttributeNames": {"#q": "request"},
+    }
+    while True:
+        page = table.scan(**scan)
+        for item in page["Items"]:
+            message = normalize.fold(item.get("request") or "")
+            if message and not message.isnumeric() and songsearch.exact(message) is None:
+                searches[normalize.search_text(message)] += 1
+        if "LastEvaluatedKey" not in page:
+            break
+        scan["ExclusiveStartKey"] = page["LastEvaluatedKey"]
+
+    print(f"Precomputing {min(limit, len(searches))} of {len(searches)} searches")
+    results = {}
+    for clean_message, _ in searches.most_common(limit):
+        result = songsearch.fuzzy(clean_message)
+        results[clean_message] = (result.stage, result.song_number, result.results)
+    snapshot.write(
+        "./lambda/search.bin", {"META": {"VERSION": VERSION}, "SEARCH_RESULTS": results}
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+import marshal
+import os
+import re
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, "./utilities")
+
+import cacheloader
+import normalize
+
+# Times a full rebuild's parsing, serially and over process pools of
+# increasing size, on the real corpus and on a synthetic one SCALE
+# times larger (every source repeated, with books renumbered). The parse is
+# first checked against the loop it replaced.
+# Usage: python utilities/cacheloader_benchmark.py; exits non-zero on a mismatch.
+SCALE = 10
+
+
+def reference_parse_book(path, bookname):
+    songs = {}
+    titles = {}
+    number = re.compile("^\d+ ")
+    with open(path, "r", encoding="UTF8") as book:
+        song_number = None
+        song_lyrics = ""
+        for line in book:
+            if number.search(line):
+                if song_number != None:
+                    song_lyrics = song_lyrics.strip()
+                    songs[song_number] = song_lyrics
+                    song_lyrics = ""
+                song_lyrics += bookname + " " + line
+                line = line.split()
+                song_number = bookname + " " + str(line.pop(0))
+                song_title = " ".join(line)
+                titles[song_number] = song_title
+            else:
+                song_lyrics += line
+        song_lyrics = song_lyrics.strip()
+        songs[song_number] = song_lyrics
+    return songs, titles
+
+
+def synthetic_corpus(directory):
+    """Writes every source SCALE times over into directory; book and chord
+    songs are renumbered so each copy adds new songs. Returns the sources."""
+    sources = []
+    for path, (source_parser, parser_args) in cacheloader.SOURCES.items():
+        with open(path, "r", encoding="UTF8") as f:
+            text = f.read()
+        copies = [text]
+        if source_parser in (cacheloader.parse_book, cacheloader.parse_chords):
+            stride = 10 ** len(str(len(text.splitlines())))
+            for copy in range(1, SCALE):
+                copies.append(
+                    re.sub(
+                        r"(?m)^(\d+)",
+                        lambda match: str(int(match.group(1)) + copy * stride),
+                        text,
+                    )
+                )
+        else:
+            copies *= SCALE
+        synthetic_path = os.path.join(directory, os.path.basename(path))
+        with open(synthetic_path, "w", encoding="UTF8") as f:
+            f.write("\n".join(copies))
+        sources.append((source_parser, synthetic_path, parser_args))
+    return sources
+
+
+def rebuild(sources, jobs, directory):
+    """What a full rebuild computes: every source's artifact. Returns the
+    books' artifacts."""
+    artifact_paths = [os.path.join(directory, f"{i}-0.marshal") for i in range(len(sources))]
+    cacheloader.build_artifacts(
+        [source + (artifact_path,) for source, artifact_path in zip(sources, artifact_paths)], jobs
+    )
+    books = []
+    for source, artifact_path in zip(sources, artifact_paths):
+        if source[0] is cacheloader.parse_book:
+            with open(artifact_path, "rb") as f:
+                books.append(marshal.load(f))
+    return books
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    real_sources = [(p, path, args) for path, (p, args) in cacheloader.SOURCES.items()]
+    book_sources = [source for source in real_sources if source[0] is cacheloader.parse_book]
+
+    artifacts = tempfile.mkdtemp()
+    corpus = tempfile.mkdtemp()
+    mismatches = 0
+    books = rebuild(real_sources, 1, artifacts)
+    for (_, path, (bookname,)), book in zip(book_sources, books):
+        songs, titles = reference_parse_book(path, bookname)
+        if (songs, titles) != (book["SONGS"], book["TITLES"]):
+            mismatches += 1
+            print("MISMATCH", path)
+    print(f"{len(books)} books checked, {mismatches} mismatches")
+
+    cpus = os.cpu_count() or 1
+    job_counts = sorted({1, 2, 4, cpus})
+    try:
+        for label, sources in (("corpus", real_sources), (f"{SCALE}x", synthetic_corpus(corpus))):
+            size = sum(os.path.getsize(path) for _, path, _ in sources)
+            print(f"{label}: {len(sources)} sources, {size / 1e6:.1f} MB, {cpus} CPUs")
+
+            def previous():
+                for source_parser, path, parser_args in sources:
+                    if source_parser is cacheloader.parse_book:
+                        songs, _ = reference_parse_book(path, *parser_args)
+                        for lyrics in songs.values():
+                            normalize.search_text(lyrics)
+                    else:
+                        source_parser(path, *parser_args)
+
+            _, elapsed = timed(previous)
+            print(f"  {'previous loader':<16} {elapsed:6.2f} s")
+            for jobs in job_counts:
+                _, elapsed = timed(rebuild, sources, jobs, artifacts)
+                print(f"  {f'{jobs} process(es)':<16} {elapsed:6.2f} s")
+    finally:
+        shutil.rmtree(artifacts)
+        shutil.rmtree(corpus)
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,36 @@
+import statistics
+import subprocess
+import sys
+
+RUNS = 10
+
+# Each run is a fresh interpreter with bytecode caching disabled, which is
+# what a Lambda cold start without bundled .pyc files pays
+PROBE = """
+import resource, time
+start = time.perf_counter()
+import cache, lookup
+imported = (time.perf_counter() - start) * 1000
+cache.SONGS["TSMS 1"], cache.TITLES["TSMS 1"], "TSMS 1" in cache.CHORDS
+first_lookup = (time.perf_counter() - start) * 1000
+print(imported, first_lookup, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+"""
+
+timings = []
+lookup_timings = []
+peak_rss = []
+for _ in range(RUNS):
+    output = subprocess.run(
+        [sys.executable, "-B", "-c", PROBE],
+        cwd="./lambda",
+        capture_output=True,
+        check=True,
+        text=True,
+    ).stdout.split()
+    timings.append(float(output[0]))
+    lookup_timings.append(float(output[1]))
+    peak_rss.append(int(output[2]))
+
+print(f"import cache, lookup: median {statistics.median(timings):.1f} ms over {RUNS} runs")
+print(f"import + first TSMS lookup: median {statistics.median(lookup_timings):.1f} ms")
+print(f"peak RSS: {max(peak_rss) / 1024:.1f} MB")
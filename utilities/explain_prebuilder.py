@@ -0,0 +1,39 @@
+import asyncio
+import sys
+import time
+
+import boto3
+
+sys.path.insert(0, "./lambda")
+
+import ai
+from cache import SONGS
+
+# Usage: python utilities/explain_prebuilder.py BOOK [BOOK ...]
+# Run after cacheloader.py. Songs that already have an explanation for their
+# current lyrics are skipped, so an interrupted run can simply be restarted.
+DELAY = 1  # seconds between model calls, to stay under the API rate limit
+
+books = set(sys.argv[1:])
+if not books:
+    sys.exit("Usage: python utilities/explain_prebuilder.py BOOK [BOOK ...]")
+
+table = boto3.resource("dynamodb").Table("tsms_explanations")
+songs = [song_number for song_number in SONGS if song_number.split(" ", 1)[0] in books]
+print(f"{len(songs)} songs in {', '.join(sorted(books))}")
+
+generated = 0
+for song_number in songs:
+    key = ai.explanation_key(song_number)
+    if "Item" in table.get_item(Key={"id": key}, ProjectionExpression="id"):
+        continue
+    print("Explaining", song_number)
+    try:
+        text = asyncio.run(ai.generate(SONGS[song_number]))
+    except Exception as e:
+        print("Failed", song_number, e)
+        continue
+    table.put_item(Item={"id": key, "text": text})
+    generated += 1
+    time.sleep(DELAY)
+print(f"Generated {generated} explanations")
@@ -1,19 +1,14 @@
-import requests
-from bs4 import BeautifulSoup
 from unidecode import unidecode
 
+import scraper
+
 base_url = "https://gettymusic.store"
-headers = {
-    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/145.0.0.0 Safari/537.36"
-}
 
 SONG_LINKS = []
-ALL_LYRICS = set()
 
 
 def get_song_links(url):
-    req = requests.get(url, headers=headers)
-    soup = BeautifulSoup(req.content, "html.parser")
+    soup = scraper.page(url)
     titles = soup.find_all("div", {"class": "songs-product-box"})
     for title in titles:
         link = title.find("a", href=True)
@@ -21,20 +16,17 @@ def get_song_links(url):
             link = link.attrs.get("href")
             SONG_LINKS.append(link)
     next_page = soup.find("a", class_="next page-numbers", href=True)
-    if next_page:
-        return next_page.attrs.get("href")
-    return None
+    next_page = next_page.attrs.get("href") if next_page else None
+    soup.decompose()
+    return next_page
 
 
 url = "/collections/all-songs?page=1&sort_by=created-ascending"
 while url:
     url = get_song_links(base_url + url)
 
-book = open("./books/G.txt", "w+")
-counter = 1
-for url in SONG_LINKS:
-    req = requests.get(base_url + url, headers=headers)
-    soup = BeautifulSoup(req.content, "html.parser")
+
+def extract(soup, url):
     title = soup.find("h1", {"class": "product-title"}).text
     title = unidecode(title).upper().strip()
     title = (
@@ -44,7 +36,6 @@ for url in SONG_LINKS:
         .split(", FEAT")[0]
         .split(" FEATURING")[0]
     )
-    print(title)
     lyrics_box = soup.find("div", {"class": "song-lyrics"}).find(
         "div", {"class": "content-container"}
     )
@@ -52,15 +43,27 @@ for url in SONG_LINKS:
         p.append("\n\n")
     for br in lyrics_box.select("br"):
         br.replace_with("\n")
-    lyrics = unidecode(lyrics_box.text).strip()
+    return title, unidecode(lyrics_box.text).strip()
+
+
+catalogue = scraper.Catalogue("./media/g_songs.json", {"./books/G.txt": r"^(\d+) "})
+# The lyrics already in the book, to skip songs the store lists twice
+ALL_LYRICS = {
+    entry.split("\n\n", 1)[-1].strip(): number for number, (entry,) in catalogue.entries.items()
+}
+urls = {url: base_url + url for url in SONG_LINKS}
+for url, digest, (title, lyrics) in scraper.scrape_changed(urls, extract, catalogue.digests()):
+    print(title)
     if "\n" not in lyrics:
         print(f"===== Skipping empty lyrics for {title} =====")
         continue
-    if lyrics in ALL_LYRICS:
+    number = catalogue.existing_number(url, title)
+    if ALL_LYRICS.get(lyrics, number) != number:
         print(f"===== Skipping duplicate for {title} =====")
         continue
-    ALL_LYRICS.add(lyrics)
-    book.write(str(counter) + " " + title + "\n\n" + lyrics + "\n\n")
-    counter += 1
+    number = catalogue.number(url, title)
+    ALL_LYRICS[lyrics] = number
+    catalogue.update(url, digest, str(number) + " " + title + "\n\n" + lyrics + "\n\n")
+catalogue.save()
 
-book.close()
+scraper.report()
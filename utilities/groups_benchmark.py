@@ -0,0 +1,77 @@
+import asyncio
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from types import SimpleNamespace
+
+sys.path.insert(0, "./lambda")
+
+import db
+import groups
+
+LATENCY = 0.02  # simulated DynamoDB / Telegram round trip, in seconds
+SIZES = (3, 10, 30, 100)
+SONG = "TSMS 1"
+
+
+class StubTable:
+    """Synchronous stand-in for a boto3 Table that sleeps like a network call."""
+
+    def __init__(self):
+        self.items = {}
+
+    def get_item(self, Key, **kwargs):
+        time.sleep(LATENCY)
+        item = self.items.get(next(iter(Key.values())))
+        return {"Item": item} if item else {}
+
+    def put_item(self, Item, **kwargs):
+        time.sleep(LATENCY)
+
+    def update_item(self, **kwargs):
+        time.sleep(LATENCY)
+        return {}
+
+
+class StubResource:
+    def __init__(self, tables):
+        self.tables = tables
+
+    def Table(self, name):
+        return self.tables[name]
+
+    def batch_get_item(self, RequestItems):
+        time.sleep(LATENCY)
+        return {"Responses": {name: [] for name in RequestItems}}
+
+
+class FakeBot:
+    async def send_message(self, **kwargs):
+        await asyncio.sleep(LATENCY)
+
+
+async def form_group(size):
+    # The last of `size` users searching the same song triggers formation,
+    # which joins every one of them to the new group
+    stubs = {name: StubTable() for name in ("tsms_users", "tsms_groups", "tsms_recents")}
+    stubs["tsms_recents"].items[SONG] = {
+        "song": SONG,
+        "users": set(range(1, size)),
+        "ttl": Decimal(int(time.time()) + 60),
+    }
+    resource = StubResource(stubs)
+    db._resource = lambda: resource
+    context = SimpleNamespace(bot=FakeBot())
+    start = time.perf_counter()
+    await groups.process_search_event(
+        context, lambda *args: None, SimpleNamespace(id=size), SONG, None
+    )
+    return (time.perf_counter() - start) * 1000
+
+
+for label, workers in (("serial", 1), (f"{db.DB_WORKERS} workers", db.DB_WORKERS)):
+    db._executor = ThreadPoolExecutor(max_workers=workers)
+    for size in SIZES:
+        elapsed = asyncio.run(form_group(size))
+        print(f"{label:<12} {size:>4} users  {elapsed:8.1f} ms")
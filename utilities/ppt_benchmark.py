@@ -0,0 +1,63 @@
+import io
+import re
+import sys
+import time
+import tracemalloc
+import zipfile
+
+sys.path.insert(0, "./lambda")
+
+import ppt
+from cache import SONGS
+
+ALLOCATION_SAMPLE = 50
+
+
+def parts(data):
+    with zipfile.ZipFile(io.BytesIO(data)) as z:
+        contents = {name: z.read(name) for name in z.namelist()}
+    # python-pptx sorts content type entries; the order carries no meaning
+    contents["[Content_Types].xml"] = sorted(
+        re.findall(rb"<(?:Override|Default)[^>]*>", contents["[Content_Types].xml"])
+    )
+    return contents
+
+
+def peak_allocation(fn, songs):
+    tracemalloc.start()
+    for song_number in songs:
+        fn(song_number)
+        tracemalloc.reset_peak()
+    peak = 0
+    for song_number in songs:
+        tracemalloc.reset_peak()
+        fn(song_number)
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+    tracemalloc.stop()
+    return peak
+
+
+songs = [song_number for song_number in SONGS if SONGS[song_number].count("\n\n") > 0]
+generators = (
+    ("python-pptx", lambda song_number: ppt.make_ppt(song_number).getvalue()),
+    ("template", ppt.render_ppt),
+)
+
+decks = {}
+for label, fn in generators:
+    fn(songs[0])  # exclude one-off template setup
+    start = time.perf_counter()
+    decks[label] = [fn(song_number) for song_number in songs]
+    elapsed = time.perf_counter() - start
+    peak = peak_allocation(fn, songs[:ALLOCATION_SAMPLE])
+    print(
+        f"{label:<12} {len(songs)} decks in {elapsed:6.2f} s  "
+        f"({elapsed / len(songs) * 1000:5.1f} ms/deck, peak alloc {peak / 1024:7.1f} KB)"
+    )
+
+different = [
+    song_number
+    for song_number, reference, fast in zip(songs, decks["python-pptx"], decks["template"])
+    if parts(reference) != parts(fast)
+]
+print(f"decks with differing parts: {len(different)}", different[:10])
@@ -0,0 +1,43 @@
+import os
+import sys
+from collections import Counter
+
+import boto3
+from boto3.dynamodb.conditions import Attr
+
+sys.path.insert(0, "./lambda")
+
+import ppt
+from cache import SONGS
+
+# Usage: python utilities/ppt_prebuilder.py [number of songs, default 100]
+# Run after cacheloader.py; decks are keyed by content digest, so ones built
+# from older lyrics are simply never read.
+top = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+
+print("Counting PPT requests in tsms_logs")
+table = boto3.resource("dynamodb").Table("tsms_logs")
+requests = Counter()
+scan = {
+    "FilterExpression": Attr("event").eq("CALLBACK") & Attr("request").eq("PPT"),
+    "ProjectionExpression": "#r",
+    "ExpressionAttributeNames": {"#r": "response"},
+}
+while True:
+    page = table.scan(**scan)
+    requests.update(item["response"] for item in page["Items"])
+    if "LastEvaluatedKey" not in page:
+        break
+    scan["ExclusiveStartKey"] = page["LastEvaluatedKey"]
+
+os.makedirs(ppt.DECKS_DIRECTORY, exist_ok=True)
+for entry in os.scandir(ppt.DECKS_DIRECTORY):
+    if entry.name.endswith(".pptx"):
+        os.remove(entry.path)
+for song_number, count in requests.most_common(top):
+    if song_number not in SONGS:
+        continue
+    print("Building", song_number, f"({count} requests)")
+    path = os.path.join(ppt.DECKS_DIRECTORY, ppt.deck_key(song_number) + ".pptx")
+    with open(path, "wb") as f:
+        f.write(ppt.make_ppt(song_number).getvalue())
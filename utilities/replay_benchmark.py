@@ -0,0 +1,518 @@
+import argparse
+import asyncio
+import copy
+import json
+import math
+import os
+import random
+import re
+import resource
+import sys
+import time
+from collections import Counter, defaultdict
+
+os.environ.setdefault("BOT_TOKEN", "1:replay")
+os.environ.setdefault("AWS_DEFAULT_REGION", "ap-southeast-1")
+os.environ.setdefault("VIDEOS_S3_BUCKET", "https://videos.invalid/")
+os.environ.setdefault("TELEMETRY", "0")
+sys.path.insert(0, "./lambda")
+
+import ai
+import db
+import lambda_function
+import logs
+import templates
+from botocore.exceptions import ClientError
+from cache import CHORDS, MP3, SCORES, SONGS, TITLES
+from telegram.ext import Application
+from telegram.request import BaseRequest
+
+# Replays a corpus of Telegram updates through lambda_handler, one at a time
+# as Lambda would, against an in-process fake Bot API and an in-memory
+# DynamoDB, and reports throughput, latency percentiles per kind of update,
+# DynamoDB and Bot API calls per update and peak RSS.
+#
+# Usage: python utilities/replay_benchmark.py [--corpus updates.jsonl]
+# Without --corpus a synthetic mix of searches and button taps is generated
+# from --seed, so the same arguments always replay the same updates. Save a
+# run with --save and compare later ones against it with --baseline.
+# --from-logs converts tsms_logs items (one JSON object per line, as scanned
+# from the table) into a corpus instead of replaying anything.
+BOT = {"id": 2, "is_bot": True, "first_name": "TSMS", "username": "tsmsbot"}
+TABLE_KEYS = {"tsms_recents": "song"}
+
+
+class FakeTable:
+    """In-memory stand-in for a boto3 Table, understanding the update and
+    condition expressions the bot uses. Every request is counted in calls
+    and takes latency seconds."""
+
+    def __init__(self, name, calls, latency):
+        self.name = name
+        self.key = TABLE_KEYS.get(name, "id")
+        self.items = {}
+        self.calls = calls
+        self.latency = latency
+
+    def request(self, operation):
+        self.calls[operation] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def get_item(self, Key, **kwargs):
+        self.request("GetItem")
+        item = self.items.get(Key[self.key])
+        return {"Item": copy.deepcopy(item)} if item else {}
+
+    def put_item(self, Item, **kwargs):
+        self.request("PutItem")
+        self.items[Item[self.key]] = copy.deepcopy(Item)
+        return {}
+
+    def update_item(
+        self,
+        Key,
+        UpdateExpression,
+        ConditionExpression=None,
+        ExpressionAttributeNames=None,
+        ExpressionAttributeValues=None,
+        ReturnValues=None,
+    ):
+        self.request("UpdateItem")
+        names = ExpressionAttributeNames or {}
+        values = ExpressionAttributeValues or {}
+        item = copy.deepcopy(self.items.get(Key[self.key]))
+        if ConditionExpression and not condition(ConditionExpression, item or {}, names, values):
+            raise ClientError(
+                {"Error": {"Code": "ConditionalCheckFailedException", "Message": "failed"}},
+                "UpdateItem",
+            )
+        item = item or dict(Key)
+        update(UpdateExpression, item, names, values)
+        self.items[Key[self.key]] = item
+        return {"Attributes": copy.deepcopy(item)} if ReturnValues == "ALL_NEW" else {}
+
+    def batch_writer(self):
+        return FakeBatchWriter(self)
+
+
+class FakeBatchWriter:
+    """Sends 25 items per BatchWriteItem, like boto3's batch_writer."""
+
+    def __init__(self, table):
+        self.table = table
+        self.count = 0
+
+    def __enter__(self):
+        return self
+
+    def put_item(self, Item):
+        self.table.items[len(self.table.items)] = Item
+        self.count += 1
+
+    def __exit__(self, *exc_info):
+        for _ in range(math.ceil(self.count / 25)):
+            self.table.request("BatchWriteItem")
+
+
+class FakeResource:
+    def __init__(self, latency):
+        self.calls = Counter()
+        self.latency = latency
+        self.tables = {}
+
+    def Table(self, name):
+        if name not in self.tables:
+            self.tables[name] = FakeTable(name, self.calls, self.latency)
+        return self.tables[name]
+
+    def batch_get_item(self, RequestItems):
+        self.calls["BatchGetItem"] += 1
+        if self.latency:
+            time.sleep(self.latency)
+        responses = {}
+        for name, request in RequestItems.items():
+            table = self.Table(name)
+            responses[name] = [
+                copy.deepcopy(table.items[key[table.key]])
+                for key in request["Keys"]
+                if key[table.key] in table.items
+            ]
+        return {"Responses": responses}
+
+
+def update(expression, item, names, values):
+    clauses = re.split(r"\b(SET|ADD|DELETE|REMOVE)\b", expression)
+    for action, arguments in zip(clauses[1::2], clauses[2::2]):
+        for argument in arguments.split(","):
+            argument = argument.strip()
+            if action == "SET":
+                name, value = (part.strip() for part in argument.split("="))
+                item[names.get(name, name)] = copy.deepcopy(values[value])
+            elif action == "REMOVE":
+                item.pop(names.get(argument, argument), None)
+            else:
+                name, value = argument.split()
+                name, value = names.get(name, name), values[value]
+                if action == "ADD" and isinstance(value, set):
+                    item[name] = item.get(name, set()) | value
+                elif action == "ADD":
+                    item[name] = item.get(name, 0) + value
+                else:
+                    item[name] = item.get(name, set()) - value
+                    if not item[name]:
+                        del item[name]
+
+
+def condition(expression, item, names, values):
+    """Evaluates the AND/OR/NOT combinations of attribute_exists,
+    attribute_not_exists and contains that the bot's conditions use."""
+    tokens = re.findall(r"\(|\)|,|[^\s(),]+", expression)
+    position = 0
+
+    def take():
+        nonlocal position
+        position += 1
+        return tokens[position - 1]
+
+    def peek():
+        return tokens[position] if position < len(tokens) else None
+
+    def either():
+        result = both()
+        while peek() == "OR":
+            take()
+            result = both() or result
+        return result
+
+    def both():
+        result = negation()
+        while peek() == "AND":
+            take()
+            result = negation() and result
+        return result
+
+    def negation():
+        if peek() == "NOT":
+            take()
+            return not negation()
+        return primary()
+
+    def primary():
+        token = take()
+        if token == "(":
+            result = either()
+            take()
+            return result
+        take()  # (
+        arguments = [take()]
+        while peek() == ",":
+            take()
+            arguments.append(take())
+        take()  # )
+        name = names.get(arguments[0], arguments[0])
+        if token == "attribute_exists":
+            return name in item
+        if token == "attribute_not_exists":
+            return name not in item
+        if token == "contains":
+            return values[arguments[1]] in item.get(name, ())
+        raise ValueError(f"Unsupported condition function {token}")
+
+    return either()
+
+
+class FakeBotAPI(BaseRequest):
+    """Answers every Bot API call in-process, after latency seconds, with a
+    minimal valid result."""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = Counter()
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    @property
+    def read_timeout(self):
+        return None
+
+    async def do_request(self, url, method, request_data=None, **kwargs):
+        api_method = url.rsplit("/", 1)[-1]
+        self.calls[api_method] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        parameters = request_data.parameters if request_data else {}
+        message = {
+            "message_id": 1,
+            "date": int(time.time()),
+            "chat": {"id": parameters.get("chat_id", 1), "type": "private"},
+        }
+        if api_method == "getMe":
+            result = BOT
+        elif api_method == "sendDocument":
+            result = dict(message, document={"file_id": "replay", "file_unique_id": "replay"})
+        elif api_method == "sendMediaGroup":
+            result = [message]
+        elif api_method in ("sendChatAction", "answerCallbackQuery", "deleteWebhook"):
+            result = True
+        else:
+            result = message
+        return 200, json.dumps({"ok": True, "result": result}).encode()
+
+
+def user(user_id):
+    return {"id": user_id, "is_bot": False, "first_name": f"User {user_id}"}
+
+
+def text_update(user_id, text):
+    message = {
+        "message_id": 1,
+        "date": int(time.time()),
+        "chat": {"id": user_id, "type": "private"},
+        "from": user(user_id),
+        "text": text,
+    }
+    if text.startswith("/"):
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+    return {"message": message}
+
+
+def callback_update(user_id, data):
+    return {
+        "callback_query": {
+            "id": "1",
+            "from": user(user_id),
+            "chat_instance": "1",
+            "data": data,
+            "message": {
+                "message_id": 1,
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+            },
+        }
+    }
+
+
+def synthetic_corpus(count, users, seed):
+    """A fixed mix of what users do: mostly TSMS numbers and titles, some
+    misspelt titles and remembered lines, and taps on the song buttons."""
+    rng = random.Random(seed)
+    songs = [song_number for song_number in SONGS if SONGS[song_number].count("\n\n") > 0]
+    tsms = [song_number for song_number in songs if song_number.startswith("TSMS")]
+
+    def misspelt(text):
+        i = rng.randrange(len(text) - 1)
+        return text[:i] + text[i + 1] + text[i] + text[i + 2 :]
+
+    def line(song_number):
+        lines = [l for l in SONGS[song_number].split("\n")[1:] if len(l.split()) >= 5]
+        return rng.choice(lines) if lines else TITLES[song_number]
+
+    kinds = {
+        "number": (30, lambda: text_update(uid, tsms_song().split()[1])),
+        "title": (20, lambda: text_update(uid, TITLES[rng.choice(songs)].title())),
+        "misspelt_title": (10, lambda: text_update(uid, misspelt(TITLES[rng.choice(songs)]))),
+        "lyrics": (10, lambda: text_update(uid, line(rng.choice(songs)))),
+        "SONG": (5, lambda: callback_update(uid, "SONG " + rng.choice(songs))),
+        "CHORDS": (5, lambda: callback_update(uid, "CHORDS " + rng.choice(list(CHORDS)))),
+        "SCORE": (3, lambda: callback_update(uid, "SCORE " + rng.choice(list(SCORES)))),
+        "MP3": (3, lambda: callback_update(uid, "MP3 " + rng.choice(list(MP3)))),
+        "PPT": (4, lambda: callback_update(uid, "PPT " + rng.choice(songs))),
+        "EXPLAIN": (2, lambda: callback_update(uid, "EXPLAIN " + rng.choice(songs))),
+        "GROUP_SEND": (3, lambda: callback_update(uid, "GROUP_SEND " + tsms_song())),
+        "/help": (3, lambda: text_update(uid, "/help")),
+        "/start": (2, lambda: text_update(uid, "/start")),
+    }
+
+    # Congregations search the same few songs, which is what forms Communities
+    def tsms_song():
+        return rng.choice(tsms[:20]) if rng.random() < 0.3 else rng.choice(tsms)
+
+    corpus = []
+    names = list(kinds)
+    weights = [kinds[name][0] for name in names]
+    for _ in range(count):
+        uid = rng.randint(1, users)
+        corpus.append(kinds[rng.choices(names, weights)[0]][1]())
+    return corpus
+
+
+def corpus_from_logs(items):
+    """Turns tsms_logs items into the updates that produced them: searches
+    become text messages and button taps callback queries."""
+    corpus = []
+    for item in sorted(items, key=lambda item: float(item.get("timestamp", 0))):
+        user_id, event = int(item["user_id"]), item.get("event")
+        request, response = item.get("request"), item.get("response")
+        if event in ("SEARCH_HIT", "SEARCH_RESULTS", "SEARCH_NONE", "SEARCH_TOO_LONG") and request:
+            corpus.append(text_update(user_id, request))
+        elif event in ("HELP", "START"):
+            corpus.append(text_update(user_id, "/" + event.lower()))
+        elif event == "CALLBACK" and request == "SONG" and response:
+            corpus.append(callback_update(user_id, "SONG " + " ".join(response.split()[:2])))
+        elif event == "CALLBACK" and request and response:
+            corpus.append(callback_update(user_id, f"{request} {response}"))
+    return corpus
+
+
+def kind(update):
+    if "callback_query" in update:
+        return "callback " + update["callback_query"]["data"].split()[0]
+    text = update["message"]["text"]
+    return text.split()[0] if text.startswith("/") else "search"
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, max(0, math.ceil(fraction * len(values)) - 1))]
+
+
+def registered(user_id):
+    return {
+        "id": user_id,
+        "name": f"User {user_id}",
+        "phone": templates.allowed_phone[0] + "90000000",
+        "state": templates.current_version,
+    }
+
+
+def replay(corpus, runtime, telegram_latency, db_latency):
+    fake_db = FakeResource(db_latency)
+    db._resource = lambda: fake_db
+    lambda_function.log_sink = logs.DynamoDBSink("tsms_logs")
+    users = fake_db.Table("tsms_users")
+    for update in corpus:
+        user_id = (update.get("message") or update.get("callback_query"))["from"]["id"]
+        users.items[user_id] = registered(user_id)
+
+    async def generate(lyrics, on_text=None):
+        # Stands in for the model, which the replay must not call
+        await asyncio.sleep(telegram_latency)
+        return "Explanation"
+
+    ai.generate = generate
+    api = FakeBotAPI(telegram_latency)
+    app = (
+        Application.builder()
+        .token(os.environ["BOT_TOKEN"])
+        .request(api)
+        .get_updates_request(FakeBotAPI())
+        .build()
+    )
+    lambda_function.add_handlers(app)
+    lambda_function.app = app
+    lambda_function.PERSISTENT_RUNTIME = runtime == "persistent"
+
+    latencies = defaultdict(list)
+    db_calls = defaultdict(list)
+    api_calls = defaultdict(list)
+    start = time.perf_counter()
+    for update_id, update in enumerate(corpus, 1):
+        update = dict(update, update_id=update_id)
+        db_before, api_before = sum(fake_db.calls.values()), sum(api.calls.values())
+        started = time.perf_counter()
+        response = lambda_function.lambda_handler(update, None)
+        elapsed = (time.perf_counter() - started) * 1000
+        if response != {"statusCode": 200}:
+            print(f"Update {update_id} ({kind(update)}) failed: {response}")
+        for label in ("all", kind(update)):
+            latencies[label].append(elapsed)
+            db_calls[label].append(sum(fake_db.calls.values()) - db_before)
+            api_calls[label].append(sum(api.calls.values()) - api_before)
+    total = time.perf_counter() - start
+
+    return {
+        "updates": len(corpus),
+        "throughput": len(corpus) / total,
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "dynamodb_calls": dict(fake_db.calls),
+        "bot_api_calls": dict(api.calls),
+        "kinds": {
+            label: {
+                "count": len(values),
+                "p50": percentile(values, 0.5),
+                "p90": percentile(values, 0.9),
+                "p99": percentile(values, 0.99),
+                "dynamodb": sum(db_calls[label]) / len(values),
+                "bot_api": sum(api_calls[label]) / len(values),
+            }
+            for label, values in sorted(latencies.items(), key=lambda kv: -len(kv[1]))
+        },
+    }
+
+
+def change(value, baseline):
+    if baseline is None:
+        return ""
+    return f" ({(value - baseline) / baseline * 100:+.0f}%)" if baseline else ""
+
+
+def report(results, baseline=None):
+    baseline = baseline or {}
+    print(
+        f"{results['updates']} updates, {results['throughput']:.1f} updates/s"
+        f"{change(results['throughput'], baseline.get('throughput'))}, "
+        f"peak RSS {results['peak_rss_mb']:.0f} MB"
+        f"{change(results['peak_rss_mb'], baseline.get('peak_rss_mb'))}"
+    )
+    print("DynamoDB:", ", ".join(f"{n} {op}" for op, n in sorted(results["dynamodb_calls"].items())))
+    print("Bot API: ", ", ".join(f"{n} {op}" for op, n in sorted(results["bot_api_calls"].items())))
+    print(f"{'':<20}{'count':>6}{'p50 ms':>9}{'p90 ms':>9}{'p99 ms':>9}{'db/upd':>8}{'api/upd':>8}")
+    for label, row in results["kinds"].items():
+        old = baseline.get("kinds", {}).get(label, {})
+        print(
+            f"{label:<20}{row['count']:>6}{row['p50']:>9.2f}{row['p90']:>9.2f}{row['p99']:>9.2f}"
+            f"{row['dynamodb']:>8.2f}{row['bot_api']:>8.2f}{change(row['p50'], old.get('p50'))}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replays Telegram updates through lambda_handler")
+    parser.add_argument("--corpus", help="JSONL of update payloads; synthetic if omitted")
+    parser.add_argument("--synthetic", type=int, default=1000, metavar="N", help="updates to generate")
+    parser.add_argument("--users", type=int, default=50, help="distinct users in the synthetic corpus")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--write-corpus", metavar="PATH", help="also write the corpus replayed")
+    parser.add_argument(
+        "--from-logs", metavar="PATH", help="convert tsms_logs items into a corpus on stdout and exit"
+    )
+    parser.add_argument("--runtime", choices=("per-invocation", "persistent"), default="per-invocation")
+    parser.add_argument("--telegram-latency", type=float, default=0.0, metavar="SECONDS")
+    parser.add_argument("--db-latency", type=float, default=0.0, metavar="SECONDS")
+    parser.add_argument("--save", metavar="PATH", help="write the results as JSON")
+    parser.add_argument("--baseline", metavar="PATH", help="compare with results saved by --save")
+    args = parser.parse_args()
+
+    if args.from_logs:
+        with open(args.from_logs, "r", encoding="UTF8") as f:
+            for update in corpus_from_logs(json.loads(line) for line in f if line.strip()):
+                print(json.dumps(update))
+        return
+
+    if args.corpus:
+        with open(args.corpus, "r", encoding="UTF8") as f:
+            corpus = [json.loads(line) for line in f if line.strip()]
+    else:
+        corpus = synthetic_corpus(args.synthetic, args.users, args.seed)
+    if args.write_corpus:
+        with open(args.write_corpus, "w", encoding="UTF8") as f:
+            for update in corpus:
+                f.write(json.dumps(update) + "\n")
+
+    results = replay(corpus, args.runtime, args.telegram_latency, args.db_latency)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, "r", encoding="UTF8") as f:
+            baseline = json.load(f)
+    report(results, baseline)
+    if args.save:
+        with open(args.save, "w", encoding="UTF8") as f:
+            json.dump(results, f, indent=1)
+
+
+if __name__ == "__main__":
+    main()
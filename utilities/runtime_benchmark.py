@@ -0,0 +1,152 @@
+import datetime
+import ipaddress
+import json
+import os
+import ssl
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509.oid import NameOID
+
+os.environ.setdefault("BOT_TOKEN", "1:benchmark")
+os.environ.setdefault("AWS_DEFAULT_REGION", "ap-southeast-1")
+os.environ.setdefault("TELEMETRY", "0")
+sys.path.insert(0, "./lambda")
+
+import db
+import lambda_function
+import logs
+from telegram.ext import Application
+from telegram.request import HTTPXRequest
+
+# Simulated network round trip to api.telegram.org, in seconds. A new
+# connection costs two more for the TCP and TLS handshakes on top of the real
+# TLS work done against localhost.
+RTT = 0.02
+UPDATES = 30
+USER = {"id": 1, "is_bot": False, "first_name": "Bench"}
+CHAT = {"id": 1, "type": "private", "first_name": "Bench"}
+
+
+class FakeTelegram(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    connections = 0
+
+    def setup(self):
+        FakeTelegram.connections += 1
+        time.sleep(2 * RTT)
+        super().setup()
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        time.sleep(RTT)
+        method = self.path.rsplit("/", 1)[-1]
+        if method == "getMe":
+            result = {"id": 2, "is_bot": True, "first_name": "TSMS", "username": "tsmsbot"}
+        else:
+            result = {"message_id": 1, "date": int(time.time()), "chat": CHAT}
+        body = json.dumps({"ok": True, "result": result}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def self_signed_certificate(directory):
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "127.0.0.1")])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    certificate = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now)
+        .not_valid_after(now + datetime.timedelta(days=1))
+        .add_extension(
+            x509.SubjectAlternativeName([x509.IPAddress(ipaddress.ip_address("127.0.0.1"))]),
+            critical=False,
+        )
+        .sign(key, hashes.SHA256())
+    )
+    cert_path = os.path.join(directory, "cert.pem")
+    key_path = os.path.join(directory, "key.pem")
+    with open(cert_path, "wb") as f:
+        f.write(certificate.public_bytes(serialization.Encoding.PEM))
+    with open(key_path, "wb") as f:
+        f.write(
+            key.private_bytes(
+                serialization.Encoding.PEM,
+                serialization.PrivateFormat.PKCS8,
+                serialization.NoEncryption(),
+            )
+        )
+    return cert_path, key_path
+
+
+def update(update_id):
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": CHAT,
+            "from": USER,
+            "text": "/help",
+            "entities": [{"type": "bot_command", "offset": 0, "length": 5}],
+        },
+    }
+
+
+async def registered_user(user_id):
+    return {"Item": {"id": user_id, "name": "Bench"}}
+
+
+directory = tempfile.mkdtemp()
+cert_path, key_path = self_signed_certificate(directory)
+server = ThreadingHTTPServer(("127.0.0.1", 0), FakeTelegram)
+server_context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+server_context.load_cert_chain(cert_path, key_path)
+server.socket = server_context.wrap_socket(server.socket, server_side=True)
+threading.Thread(target=server.serve_forever, daemon=True).start()
+
+# Only the Telegram side is measured, so DynamoDB is stubbed out
+db.get_user = registered_user
+lambda_function.log_sink = logs.MemorySink()
+
+for label, persistent in (("per-invocation", False), ("persistent", True)):
+    app = (
+        Application.builder()
+        .token(os.environ["BOT_TOKEN"])
+        .base_url(f"https://127.0.0.1:{server.server_address[1]}/bot")
+        .request(HTTPXRequest(httpx_kwargs={"verify": ssl.create_default_context(cafile=cert_path)}))
+        .build()
+    )
+    lambda_function.add_handlers(app)
+    lambda_function.app = app
+    lambda_function.PERSISTENT_RUNTIME = persistent
+    FakeTelegram.connections = 0
+
+    timings = []
+    for update_id in range(1, UPDATES + 1):
+        start = time.perf_counter()
+        response = lambda_function.lambda_handler(update(update_id), None)
+        timings.append((time.perf_counter() - start) * 1000)
+        assert response == {"statusCode": 200}, response
+    warm = timings[1:]
+    print(
+        f"{label:<15} first {timings[0]:6.1f} ms  warm median {statistics.median(warm):6.1f} ms  "
+        f"p90 {statistics.quantiles(warm, n=10)[-1]:6.1f} ms  connections {FakeTelegram.connections}"
+    )
@@ -0,0 +1,239 @@
+import contextlib
+import hashlib
+import json
+import os
+import re
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Shared by the *_scraper.py scripts. Pages are fetched CONCURRENCY at a time
+# over one pooled session and kept in CACHE_DIRECTORY with their ETag and
+# Last-Modified, so a re-run revalidates each page and only downloads the ones
+# that changed. SCRAPER_OFFLINE=1 serves pages from that cache alone, which
+# replays a previous run without any network access.
+CONCURRENCY = int(os.getenv("SCRAPER_CONCURRENCY", "10"))
+CACHE_DIRECTORY = os.getenv("SCRAPER_CACHE_DIRECTORY", "./build/scraper")
+OFFLINE = os.getenv("SCRAPER_OFFLINE") == "1"
+# Only parse the songs whose page changed since the book was last written
+INCREMENTAL = os.getenv("SCRAPER_INCREMENTAL") == "1"
+TIMEOUT_SECONDS = 30
+
+HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/145.0.0.0 Safari/537.36"
+}
+
+session = requests.Session()
+session.headers.update(HEADERS)
+adapter = HTTPAdapter(
+    pool_connections=CONCURRENCY,
+    pool_maxsize=CONCURRENCY,
+    max_retries=Retry(total=3, backoff_factor=1, status_forcelist=(429, 500, 502, 503, 504)),
+)
+session.mount("https://", adapter)
+session.mount("http://", adapter)
+
+stats = Counter()
+stats_lock = threading.Lock()
+
+
+def count(event):
+    with stats_lock:
+        stats[event] += 1
+
+
+def cache_paths(url):
+    key = hashlib.sha1(url.encode("UTF-8")).hexdigest()
+    return os.path.join(CACHE_DIRECTORY, key + ".html"), os.path.join(CACHE_DIRECTORY, key + ".json")
+
+
+def write_atomically(path, data):
+    with open(path + ".tmp", "wb") as f:
+        f.write(data)
+    os.replace(path + ".tmp", path)
+
+
+def fetch(url):
+    """The body of url, from the cache if the server says it hasn't changed."""
+    body_path, meta_path = cache_paths(url)
+    meta = None
+    if os.path.exists(meta_path):
+        with open(meta_path, "r", encoding="UTF8") as f:
+            meta = json.load(f)
+    if OFFLINE:
+        if meta is None:
+            raise LookupError(f"{url} is not in {CACHE_DIRECTORY}")
+        count("replayed")
+        with open(body_path, "rb") as f:
+            return f.read()
+
+    headers = {}
+    if meta is not None:
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+    response = session.get(url, headers=headers, timeout=TIMEOUT_SECONDS)
+    if response.status_code == 304 and meta is not None:
+        count("not modified")
+        with open(body_path, "rb") as f:
+            return f.read()
+    response.raise_for_status()
+    count("downloaded")
+
+    os.makedirs(CACHE_DIRECTORY, exist_ok=True)
+    # The body first: metadata on disk means its body is there too
+    write_atomically(body_path, response.content)
+    meta = {
+        "url": url,
+        "etag": response.headers.get("ETag"),
+        "last_modified": response.headers.get("Last-Modified"),
+    }
+    write_atomically(meta_path, json.dumps(meta).encode("UTF-8"))
+    return response.content
+
+
+def page(url):
+    return BeautifulSoup(fetch(url), "html.parser")
+
+
+def extracted(body, url, extract):
+    soup = BeautifulSoup(body, "html.parser")
+    try:
+        return extract(soup, url)
+    finally:
+        soup.decompose()
+
+
+def scrape(urls, extract):
+    """Yields extract(soup, url) for each url, in the order given, while
+    CONCURRENCY pages are fetched and parsed in the background. Each tree is
+    decomposed as soon as extract returns, so only what it extracted stays
+    in memory."""
+    with ThreadPoolExecutor(max_workers=CONCURRENCY) as executor:
+        yield from executor.map(lambda url: extracted(fetch(url), url, extract), urls)
+
+
+def scrape_changed(urls, extract, digests):
+    """scrape() for {slug: url}, yielding (slug, digest, record) only for the
+    pages whose sha1 isn't digests[slug]: new songs and ones whose page
+    changed since the digests were saved."""
+
+    def run(slug):
+        body = fetch(urls[slug])
+        digest = hashlib.sha1(body).hexdigest()
+        if digests.get(slug) == digest:
+            return None
+        return slug, digest, extracted(body, urls[slug], extract)
+
+    with ThreadPoolExecutor(max_workers=CONCURRENCY) as executor:
+        for result in executor.map(run, urls):
+            if result is not None:
+                yield result
+
+
+@contextlib.contextmanager
+def output(path):
+    """Opens path for writing text, replacing the old file only once the
+    scrape has finished, so a failed run leaves it as it was."""
+    try:
+        with open(path + ".tmp", "w", encoding="UTF8") as f:
+            yield f
+    except BaseException:
+        os.remove(path + ".tmp")
+        raise
+    os.replace(path + ".tmp", path)
+
+
+class Catalogue:
+    """A scraped book and its media files, kept stable across runs. A song's
+    number is fixed the first time it is written and kept in path, a JSON
+    file committed with the book. New songs go after the existing ones, an
+    updated song keeps its number and songs the site drops are kept, so
+    stored callbacks and link keys never move. The files are rewritten in
+    number order, with the entries of songs that weren't scraped again
+    copied from the previous files unchanged.
+
+    path is built from the existing book by utilities/seed_catalogues.py,
+    with slugs guessed from the titles and PDF names. A page whose slug
+    wasn't guessed right takes the number of the seeded song with its
+    title, if that song hasn't been scraped since."""
+
+    def __init__(self, path, files):
+        """files maps each output file to a regular expression matching the
+        first line of a song's entry, with the number as its first group."""
+        if not os.path.exists(path):
+            # Numbering in crawl order would renumber every song in the book
+            raise FileNotFoundError(f"{path} is missing; run utilities/seed_catalogues.py first")
+        self.path = path
+        self.files = {file_path: re.compile(header, re.M) for file_path, header in files.items()}
+        # slug: {"number": ..., "title": ..., "digest": sha1 of the page last written}
+        with open(path, "r", encoding="UTF8") as f:
+            self.songs = json.load(f)
+        # number: [the song's entry in each file]
+        self.entries = {}
+        known = {song["number"] for song in self.songs.values()}
+        for i, (file_path, header) in enumerate(self.files.items()):
+            if not os.path.exists(file_path):
+                continue
+            with open(file_path, "r", encoding="UTF8") as f:
+                text = f.read()
+            starts = [match for match in header.finditer(text) if int(match.group(1)) in known]
+            ends = [match.start() for match in starts[1:]] + [len(text)]
+            for match, end in zip(starts, ends):
+                entries = self.entries.setdefault(int(match.group(1)), [""] * len(self.files))
+                entries[i] = text[match.start() : end]
+
+    def digests(self):
+        if not INCREMENTAL:
+            return {}
+        return {slug: song["digest"] for slug, song in self.songs.items()}
+
+    def adopt(self, slug, title):
+        """Moves the first unscraped seeded song titled title to slug."""
+        if slug in self.songs or title is None:
+            return
+        for seeded, song in sorted(self.songs.items(), key=lambda item: item[1]["number"]):
+            if song["digest"] is None and song.get("title") == title.upper():
+                self.songs[slug] = self.songs.pop(seeded)
+                return
+
+    def existing_number(self, slug, title=None):
+        self.adopt(slug, title)
+        return self.songs[slug]["number"] if slug in self.songs else None
+
+    def number(self, slug, title=None):
+        """The slug's number, giving it the next free one if it has none."""
+        self.adopt(slug, title)
+        if slug not in self.songs:
+            number = max((song["number"] for song in self.songs.values()), default=0) + 1
+            self.songs[slug] = {"number": number, "digest": None}
+        if title is not None:
+            self.songs[slug]["title"] = title.upper()
+        return self.songs[slug]["number"]
+
+    def update(self, slug, digest, *entries):
+        """Replaces the song's entries, one per file, in the order given."""
+        self.songs[slug]["digest"] = digest
+        self.entries[self.number(slug)] = list(entries)
+
+    def save(self):
+        with contextlib.ExitStack() as stack:
+            files = [stack.enter_context(output(file_path)) for file_path in self.files]
+            for number in sorted(self.entries):
+                for f, entry in zip(files, self.entries[number]):
+                    f.write(entry)
+        write_atomically(self.path, dumps(self.songs).encode("UTF-8"))
+
+
+def dumps(songs):
+    return json.dumps(songs, indent=1, sort_keys=True) + "\n"
+
+
+def report():
+    print(", ".join(f"{number} {event}" for event, number in sorted(stats.items())) or "Nothing fetched")
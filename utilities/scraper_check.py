@@ -0,0 +1,113 @@
+import argparse
+import filecmp
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+import scraper
+
+# Runs each scraper offline against the recorded pages in FIXTURES and checks
+# the books, links files and number maps it writes against the expected ones.
+# A fixture is a directory with pages.json (url: file in pages/), input/ (the
+# books and media before the run) and expected/ (the same files after it).
+# Each scraper runs twice: the second run, with SCRAPER_INCREMENTAL=1, must
+# leave every file as the first run wrote it.
+#
+# Usage: python utilities/scraper_check.py [site ...]; exits non-zero on a
+# difference. --update rewrites expected/ from the run, after a deliberate
+# change to a scraper; --record downloads the pages again from the sites.
+FIXTURES = "./utilities/fixtures/scraper"
+SCRAPERS = {"ca": "ca_scraper.py", "getty": "getty_scraper.py", "sgm": "sgm_scraper.py"}
+
+
+def pages(site):
+    with open(os.path.join(FIXTURES, site, "pages.json"), "r", encoding="UTF8") as f:
+        return json.load(f)
+
+
+def record(site):
+    for url, name in pages(site).items():
+        response = scraper.session.get(url, timeout=scraper.TIMEOUT_SECONDS)
+        response.raise_for_status()
+        scraper.write_atomically(os.path.join(FIXTURES, site, "pages", name), response.content)
+        print(f"Recorded {url}")
+
+
+def files(directory):
+    return sorted(
+        os.path.relpath(os.path.join(root, name), directory)
+        for root, _, names in os.walk(directory)
+        for name in names
+    )
+
+
+def run(site, workdir, incremental):
+    """Runs the site's scraper in workdir with the recorded pages as its
+    cache, with no network access."""
+    cache = os.path.join(workdir, "cache")
+    os.makedirs(cache, exist_ok=True)
+    for url, name in pages(site).items():
+        body_path, meta_path = (os.path.join(cache, os.path.basename(p)) for p in scraper.cache_paths(url))
+        shutil.copyfile(os.path.join(FIXTURES, site, "pages", name), body_path)
+        with open(meta_path, "w", encoding="UTF8") as f:
+            json.dump({"url": url, "etag": None, "last_modified": None}, f)
+    env = dict(
+        os.environ,
+        SCRAPER_OFFLINE="1",
+        SCRAPER_CACHE_DIRECTORY=cache,
+        SCRAPER_INCREMENTAL="1" if incremental else "0",
+    )
+    script = os.path.abspath(os.path.join("./utilities", SCRAPERS[site]))
+    subprocess.run([sys.executable, script], cwd=workdir, env=env, check=True, capture_output=True)
+    shutil.rmtree(cache)
+
+
+def check(site, update):
+    fixture = os.path.join(FIXTURES, site)
+    expected = os.path.join(fixture, "expected")
+    failures = 0
+    with tempfile.TemporaryDirectory() as workdir:
+        shutil.copytree(os.path.join(fixture, "input"), workdir, dirs_exist_ok=True)
+        run(site, workdir, incremental=False)
+        if update:
+            shutil.rmtree(expected, ignore_errors=True)
+            shutil.copytree(workdir, expected)
+            print(f"{site}: updated {', '.join(files(expected))}")
+            return 0
+        for attempt in ("full", "incremental"):
+            written = files(workdir)
+            if written != files(expected):
+                print(f"FAIL {site} ({attempt}): wrote {written}, expected {files(expected)}")
+                failures += 1
+            for name in sorted(set(written) & set(files(expected))):
+                if not filecmp.cmp(os.path.join(workdir, name), os.path.join(expected, name), shallow=False):
+                    print(f"FAIL {site} ({attempt}): {name} differs from {os.path.join(expected, name)}")
+                    failures += 1
+            if attempt == "full":
+                run(site, workdir, incremental=True)
+    print(f"{site}: {'ok' if not failures else f'{failures} failures'}")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Checks the scrapers against recorded pages")
+    parser.add_argument("sites", nargs="*", help=f"any of {', '.join(SCRAPERS)}; all by default")
+    parser.add_argument("--update", action="store_true", help="rewrite the expected output")
+    parser.add_argument("--record", action="store_true", help="download the pages again first")
+    args = parser.parse_args()
+    unknown = set(args.sites) - set(SCRAPERS)
+    if unknown:
+        parser.error(f"no scraper for {', '.join(sorted(unknown))}")
+    failures = 0
+    for site in args.sites or SCRAPERS:
+        if args.record:
+            record(site)
+        failures += check(site, args.update)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
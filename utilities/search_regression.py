@@ -0,0 +1,48 @@
+import sys
+
+sys.path.insert(0, "./lambda")
+
+import songsearch
+
+# Real queries (already normalized as the search handler does) and the songs
+# acceptable as the top answer. Lyric queries accept any book's copy of the
+# hymn, since identical lyrics score the same.
+# Usage: python utilities/search_regression.py; exits non-zero on a failure.
+CASES = [
+    ("TSMS 494", {"TSMS 494"}),
+    ("AMAZING GRACE", {"TSMS 494"}),
+    ("AMAZNG GRACE", {"TSMS 494"}),
+    ("HOW GRAET THOU ART", {"TSMS 513"}),
+    ("SILENT NIHGT", {"C 1", "G 90"}),
+    ("GREAT IS THY FAITHFULLNESS", {"TSMS 628"}),
+    ("IN CRHIST ALONE", {"G 5"}),
+    ("BE THOU MY VISON", {"TSMS 301"}),
+    ("JESUS LOVES ME", {"TSMS 507"}),
+    ("THE SOLID ROCK", {"TSMS 555"}),
+    ("A MIGHTY FORTRESS IS OUR GOD", {"G 79"}),
+    ("BECAUSE HE LIVES I CAN FACE TOMORROW", {"TSMS 680"}),
+    ("WHEN PEACE LIKE A RIVER ATTENDETH MY WAY", {"TSMS 576"}),
+    ("O LORD MY GOD WHEN I IN AWESOME WONDER", {"TSMS 513", "G 259", "HGG 28", "HOG 5", "RHC 49"}),
+    ("MORNING BY MORNING NEW MERCIES I SEE", {"TSMS 628", "G 80"}),
+    ("TWAS GRACE THAT TAUGHT MY HEART TO FEAR", {"TSMS 494", "G 17", "WIS 105", "HOG 89", "G 286"}),
+    ("NO GUILT IN LIFE NO FEAR IN DEATH", {"G 5", "G 276", "HOG 177", "WIS 42"}),
+    ("HOLY HOLY HOLY LORD GOD ALMIGHTY", {"TSMS 633", "HGG 3", "HOG 48", "RHC 8", "SGM 170"}),
+    ("JOY TO THE WORLD THE LORD IS COME", {"SGM 235", "HGG 92", "HOG 224", "RHC 152"}),
+    ("HOW SWEET THE SOUND", {"TSMS 494", "G 17", "WIS 105", "HOG 89", "G 286"}),
+]
+
+failures = 0
+stages = {}
+for query, expected in CASES:
+    result = songsearch.find(query)
+    top = result.song_number or next(iter(result.results), None)
+    for stage, elapsed in result.timings.items():
+        stages.setdefault(stage, []).append(elapsed)
+    if top not in expected:
+        failures += 1
+        print(f"FAIL {query!r}: got {top} ({result.stage}), expected one of {sorted(expected)}")
+
+for stage, timings in stages.items():
+    print(f"{stage:<12} ran {len(timings):>3}x  max {max(timings):7.2f} ms")
+print(f"{len(CASES) - failures}/{len(CASES)} passed")
+sys.exit(1 if failures else 0)
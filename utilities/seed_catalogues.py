@@ -0,0 +1,83 @@
+import os
+import re
+
+from unidecode import unidecode
+
+import scraper
+
+# Builds the slug: number maps scraper.Catalogue keeps the scraped books
+# stable with, from the books as they are, so that the first run of the
+# scrapers with Catalogue keeps the existing numbers. Run once per book, when
+# its map doesn't exist yet, and commit the maps it writes.
+#
+# Usage: python utilities/seed_catalogues.py
+# The pages' slugs aren't in the books, so they are guessed from the PDF
+# names in the links files, which include any leading article the title
+# dropped, or else from the title. Catalogue matches a page it can't find by
+# slug to the seeded song with its title instead.
+BOOKS = {
+    "./media/ca_songs.json": ("./books/CA.txt", "./media/ca_links.txt", "/song/{}/"),
+    "./media/g_songs.json": ("./books/G.txt", None, "/products/{}"),
+    "./media/sgm_songs.json": ("./books/SGM.txt", "./media/sgm_links.txt", "{}/"),
+}
+
+
+def slugify(text):
+    return re.sub(r"[^a-z0-9]+", "-", unidecode(text).lower().replace("'", "")).strip("-")
+
+
+def titles(book_path):
+    with open(book_path, "r", encoding="UTF8") as f:
+        return {int(number): title.strip() for number, title in re.findall(r"^(\d+) (.*)$", f.read(), re.M)}
+
+
+def pdf_names(links_path):
+    """number: [the slugified name of each PDF linked for the song]"""
+    names = {}
+    if links_path is None:
+        return names
+    with open(links_path, "r", encoding="UTF8") as f:
+        for block in f.read().strip().split("\n\n"):
+            number, *links = block.split("\n")
+            names[int(number)] = [
+                slugify(os.path.splitext(href.rsplit("/", 1)[-1])[0])
+                for href in (link.split("|", 1)[-1] for link in links)
+                if href.endswith(".pdf")
+            ]
+    return names
+
+
+def slug(title, names):
+    title_slug = slugify(title)
+    for name in names:
+        if title_slug in name:
+            return name[: name.index(title_slug) + len(title_slug)]
+    return title_slug
+
+
+def seed(book_path, links_path, pattern):
+    songs = {}
+    names = pdf_names(links_path)
+    for number, title in sorted(titles(book_path).items()):
+        key = pattern.format(slug(title, names.get(number, ())))
+        # Repeated titles get the suffixes the sites give them
+        base, suffix = key, 1
+        while key in songs:
+            suffix += 1
+            key = base.rstrip("/") + f"-{suffix}" + ("/" if base.endswith("/") else "")
+        songs[key] = {"number": number, "title": title, "digest": None}
+    return songs
+
+
+def main():
+    for path, (book_path, links_path, pattern) in BOOKS.items():
+        if os.path.exists(path):
+            print(f"{path} exists, leaving it")
+            continue
+        songs = seed(book_path, links_path, pattern)
+        scraper.write_atomically(path, scraper.dumps(songs).encode("UTF-8"))
+        print(f"{path}: {len(songs)} songs from {book_path}")
+
+
+if __name__ == "__main__":
+    main()
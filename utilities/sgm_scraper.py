@@ -1,14 +1,10 @@
 import re
-from concurrent.futures import ThreadPoolExecutor
 
-import requests
-from bs4 import BeautifulSoup
 from unidecode import unidecode
 
+import scraper
+
 base_url = "https://sovereigngracemusic.com/music/songs/"
-headers = {
-    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/145.0.0.0 Safari/537.36"
-}
 
 
 song_links = {}
@@ -16,19 +12,18 @@ song_links = {}
 
 def get_song_links(url):
     print(url)
-    req = requests.get(url, headers=headers)
-    soup = BeautifulSoup(req.content, "html.parser")
+    soup = scraper.page(url)
     titles = soup.find_all("h3")
     for title in titles:
         link = title.find("a", href=True)
         if link:
             link = link.attrs.get("href")
             if link.startswith(base_url):
-                song_links[link.replace(base_url, "")] = {}
+                song_links[link.replace(base_url, "")] = None
     next_page = soup.find("a", class_="page-numbers next")
-    if next_page:
-        return next_page.attrs.get("href")
-    return None
+    next_page = next_page.attrs.get("href") if next_page else None
+    soup.decompose()
+    return next_page
 
 
 url = base_url
@@ -36,47 +31,27 @@ while url:
     url = get_song_links(url)
 
 
-def populate_song_content(song):
-    print(song)
-    req = requests.get(base_url + song, headers=headers)
-    soup = BeautifulSoup(req.content, "html.parser")
-    song_links[song] = soup
-
-
-with ThreadPoolExecutor(max_workers=10) as executor:
-    for song in song_links.keys():
-        executor.submit(populate_song_content, song)
-
-
-book = open("./books/SGM.txt", "w+")
-media = open("./media/sgm_links.txt", "w+")
-
-counter = 1
-
-for song, soup in song_links.items():
+def extract(soup, url):
+    """Returns the song's title, its stanzas (None if it has no lyrics) and
+    its links as (text, href) pairs."""
     base_title = unidecode(soup.find("h1").text)
-    title = str(counter) + " " + base_title.upper()
-    print(title)
     lyrics_box = soup.find("div", class_="elementor-widget-theme-post-content")
     if not lyrics_box:
-        continue
-    lyrics_stanzas = lyrics_box.find_all("p")
-    lyrics = title
-    for stanza in lyrics_stanzas:
-        lyrics += "\n\n" + stanza.text
-    links = str(counter)
+        return base_title, None, []
+    stanzas = [stanza.text for stanza in lyrics_box.find_all("p")]
+    links = []
     resources_box = soup.find("div", class_="song_resources")
     resources = resources_box.find_all("a", href=True)
     for link in resources:
         if link.text and link.attrs.get("href"):
-            links += "\n" + link.text + "|" + link.attrs.get("href")
+            links.append((link.text, link.attrs.get("href")))
     buy_box = soup.find("div", class_="song_listen-buy")
     buys = buy_box.find_all("a", href=True)
     for link in buys:
         if link.text and link.attrs.get("href"):
             href = link.attrs.get("href")
             if "open.spotify.com" in href:
-                links += "\n" + "Spotify|" + href
+                links.append(("Spotify", href))
     video_box = soup.find("div", class_="glide__track")
     if video_box:
         videos = video_box.find_all("iframe")
@@ -85,19 +60,32 @@ for song, soup in song_links.items():
             if not video_url:
                 continue
             video_id = video_url.group(1)
-            links += (
-                "\n"
-                + "YouTube: "
-                + unidecode(link.attrs.get("title"))
-                .replace("|", "")
-                .lstrip(base_title)
-                .strip("* []")
-                + "|"
-                + "https://www.youtube.com/watch?v="
-                + video_id
+            links.append(
+                (
+                    "YouTube: "
+                    + unidecode(link.attrs.get("title"))
+                    .replace("|", "")
+                    .lstrip(base_title)
+                    .strip("* []"),
+                    "https://www.youtube.com/watch?v=" + video_id,
+                )
             )
-    book.write(unidecode(lyrics))
-    book.write("\n\n")
-    media.write(unidecode(links))
-    media.write("\n\n")
-    counter += 1
+    return base_title, stanzas, links
+
+
+catalogue = scraper.Catalogue(
+    "./media/sgm_songs.json", {"./books/SGM.txt": r"^(\d+) ", "./media/sgm_links.txt": r"^(\d+)$"}
+)
+urls = {song: base_url + song for song in song_links}
+songs = scraper.scrape_changed(urls, extract, catalogue.digests())
+for song, digest, (base_title, stanzas, song_resources) in songs:
+    print(base_title.upper())
+    if stanzas is None:
+        continue
+    number = str(catalogue.number(song, base_title))
+    lyrics = "\n\n".join([number + " " + base_title.upper()] + stanzas)
+    links = "\n".join([number] + [text + "|" + href for text, href in song_resources])
+    catalogue.update(song, digest, unidecode(lyrics) + "\n\n", unidecode(links) + "\n\n")
+catalogue.save()
+
+scraper.report()
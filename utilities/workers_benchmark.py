@@ -0,0 +1,109 @@
+import asyncio
+import os
+import random
+import re
+import statistics
+import sys
+import time
+
+os.environ.setdefault("BOT_TOKEN", "1:benchmark")
+os.environ.setdefault("AWS_DEFAULT_REGION", "ap-southeast-1")
+sys.path.insert(0, "./lambda")
+
+import ppt
+import songsearch
+import workers
+from cache import SONGS
+
+# Requests arrive at RATE per second: most are cheap (a title or number
+# lookup), some are lyric searches and a few are PPT decks. Latency is
+# measured from arrival, so time spent stuck behind other work counts.
+RATE = 60
+REQUESTS = 600
+MIX = (("light", 0.6), ("search", 0.3), ("ppt", 0.1))
+
+song_numbers = [song_number for song_number in SONGS if SONGS[song_number].count("\n\n") > 0]
+queries = []
+
+
+def light():
+    return SONGS.get(random.choice(song_numbers))
+
+
+def deck(song_number):
+    # Bypasses the per-process deck cache so every request does the work
+    return ppt.render_ppt(song_number)
+
+
+async def handle(kind, run):
+    if kind == "light":
+        await asyncio.sleep(0)
+        light()
+    elif kind == "search":
+        await run("threads", songsearch.fuzzy, random.choice(queries))
+    else:
+        await run("processes", deck, random.choice(song_numbers))
+
+
+async def workload(run):
+    kinds = random.choices([k for k, _ in MIX], weights=[w for _, w in MIX], k=REQUESTS)
+    latencies = {kind: [] for kind, _ in MIX}
+    busy = 0
+    start = time.perf_counter()
+
+    async def request(i, kind):
+        nonlocal busy
+        arrival = start + i / RATE
+        await asyncio.sleep(max(0, arrival - time.perf_counter()))
+        try:
+            await handle(kind, run)
+        except workers.Busy:
+            busy += 1
+            return
+        latencies[kind].append((time.perf_counter() - arrival) * 1000)
+
+    await asyncio.gather(*(request(i, kind) for i, kind in enumerate(kinds)))
+    return latencies, busy
+
+
+def p99(values):
+    return statistics.quantiles(values, n=100)[-1] if len(values) > 1 else float("nan")
+
+
+async def inline_run(pool, fn, *args):
+    return fn(*args)
+
+
+async def pooled_run(pool, fn, *args):
+    return await getattr(workers, pool).run(fn, *args)
+
+
+def report(label, run):
+    random.seed(1)
+    latencies, busy = asyncio.run(workload(run))
+    summary = "  ".join(
+        f"{kind} p50 {statistics.median(values):6.1f} p99 {p99(values):6.1f}"
+        for kind, values in latencies.items()
+    )
+    print(f"{label:<14} {summary}  (ms)  busy {busy}")
+
+
+def main():
+    random.seed(0)
+    for song_number in random.sample(song_numbers, 200):
+        lines = [line for line in SONGS[song_number].split("\n")[1:] if len(line) > 20]
+        if lines:
+            queries.append(re.sub("[^A-Z ]", "", random.choice(lines).upper()).strip())
+
+    print(f"{REQUESTS} requests at {RATE}/s, {os.cpu_count()} CPUs")
+    report("on event loop", inline_run)
+    report("thread pools", pooled_run)
+    workers.start_processes()
+    asyncio.run(workers.processes.run(ppt.template_parts))  # wait for the spawn
+    report("+ processes", pooled_run)
+    workers.shutdown()
+
+
+# Worker processes are spawned and re-import this module
+if __name__ == "__main__":
+    main()